@@ -1,6 +1,6 @@
 ''' 
   Customized configuration settings for FDS and asias_fds libraries
-  Note: Oracle settings are managed in fds_oracle.py
+  Note: Oracle settings are managed in fds_oracle.py, except for the session pool sizes below
 '''
 
 # base paths
@@ -13,9 +13,42 @@ BASE_DATA_PATH = 'c:/asias_fds/base_data/'
 PROFILE_DATA_PATH = 'c:/asias_fds/data_from_profiles/'
 PROFILE_REPORTS_PATH = 'c:/asias_fds/profile_reports/'
 
+# process orders (dependency graphs) saved between runs. Comment out to rebuild every run.
+PROCESS_ORDER_CACHE_PATH = 'c:/asias_fds/process_order_cache/'
+
 # API Handler  -- use of the Web API requires coordination with Flight Data Services
 #API_HANDLER = 'analysis_engine.api_handler_analysis_engine.AnalysisEngineAPIHandlerHTTP'
 API_HANDLER = 'analysis_engine.api_handler_analysis_engine.AnalysisEngineAPIHandlerLocal'
 
 # Set the base URL for the API handler:
-BASE_URL = '' #if API_HANDLER is local
\ No newline at end of file
+BASE_URL = '' #if API_HANDLER is local
+
+# Oracle session pool used by fds_oracle.get_connection()
+ORACLE_POOL_MIN = 1
+ORACLE_POOL_MAX = 4
+ORACLE_POOL_INCREMENT = 1
+ORACLE_ARRAYSIZE = 1000  # rows fetched per round trip by fds_oracle.iter_query
+
+# results database: 'oracle' (fds_oracle) or 'sqlite' (fds_sqlite, a local file for laptop and offline runs)
+DB_BACKEND = 'oracle'
+SQLITE_DB_PATH = 'c:/asias_fds/fds_results.sqlite'
+
+# KPV/KTI/phase rows and flight records are also exported as Parquet here (needs pyarrow). Comment out to skip.
+#PARQUET_EXPORT_PATH = 'c:/asias_fds/measures_parquet/'
+
+# index of flight files (sqlite), so input directories and shares are relisted only when they change.
+# Comment out to glob the directories every run.
+FLIGHT_CATALOG_PATH = 'c:/asias_fds/flight_catalog.sqlite'
+# file names catalogued in each directory; callers' own patterns (e.g. '*.hdf5') are applied to the catalog
+#FLIGHT_CATALOG_PATTERN = '*'
+# regex whose first three groups are year, month and day of the flight, from the file name
+#FLIGHT_DATE_PATTERN = r'((?:19|20)\d\d)[-_]?(\d\d)[-_]?(\d\d)'
+
+# flight_record_filepaths results (e.g. the query-based flight sets) are saved here and reused
+# for QUERY_CACHE_TTL seconds.  Off by default: a cached flight set misses flights loaded since it was saved.
+#QUERY_CACHE_PATH = 'c:/asias_fds/query_cache/'
+#QUERY_CACHE_TTL = 3600
+
+# local scratch directory for run_analyzer(..., prefetch=N): flights on the shares are copied here ahead of use
+PREFETCH_PATH = 'c:/asias_fds/prefetch_cache/'
+PREFETCH_MAX_BYTES = 20*2**30
@@ -67,6 +67,7 @@ create table fds_processing_time (
 	 cmt			varchar2(96)
 );
 
+-- columns added since are listed in flight_record_spec.py; 'python flight_record_spec.py' prints the current DDL
 create table fds_flight_record (	
 	source_file	    varchar2(128) primary key,
 	tail_number	    varchar2(32),
@@ -119,3 +120,21 @@ alter table fds_kpv add (file_repository varchar2(128));
 alter table fds_kpv add (profile_set varchar2(96));
 
 update fds_phase set profile_set='base' where profile='base'
+
+alter table fds_jobs add (skipped_count number);
+
+create table fds_node_timing (
+	run_time		timestamp,
+	stage			varchar2(64),
+	profile			varchar2(128),
+	source_file		varchar2(128),
+	node_name		varchar2(128),
+	node_type		varchar2(64),
+	deps_seconds	number,
+	derive_seconds	number,
+	input_bytes		number,
+	output_bytes	number,
+	output_count	number
+);
+
+create index fds_node_timing_name on fds_node_timing (profile, node_name);
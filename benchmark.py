@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+benchmark : offline timings of the staged_helper hot paths on synthetic flights.
+
+Nothing here needs the shared drives or Oracle: flights are generated as hdf5 files
+in a scratch directory, the node set is a small synthetic profile defined below, and
+the reporting writers run against an in-memory sqlite3 database with the fds_sqlite tables.
+
+Usage:
+    python benchmark.py --duration 3600 --frequency 8 --params 100 --repeat 5 --out bench.jsonl
+
+Each benchmark appends one JSON object per line to --out (or prints it), with the case
+settings, the analyzer and library versions, and min/median/mean seconds over the repeats,
+so results from different commits or machines can be compared.
+"""
+import os, sys, time, json, shutil, tempfile, socket, platform, argparse, sqlite3
+import cPickle as pickle
+from datetime import datetime
+
+import numpy as np
+import h5py
+from hdfaccess.file import hdf_file
+from hdfaccess.parameter import Parameter
+from analysis_engine import __version__ as analyzer_version
+from analysis_engine import settings
+from analysis_engine.dependency_graph import dependency_order
+from analysis_engine.node import (DerivedParameterNode, FlightPhaseNode,
+                                  KeyPointValueNode, KeyTimeInstanceNode,
+                                  NodeManager, P)
+
+import flight_store
+import fds_sqlite
+import flight_record_spec
+import staged_helper as sh
+
+AIRCRAFT_INFO = {'Frame': 'Synthetic', 'Manufacturer': 'Synthetic', 'Precise Positioning': True,
+                 'Series': 'Synthetic', 'Family': 'Synthetic', 'Frame Doubled': False, 'Tail Number': 'SYN001'}
+START_DATETIME = datetime(2012, 4, 1, 0, 0, 0)
+
+
+### synthetic flights
+def series_name(i):
+    return 'Synthetic %03d' % i
+
+
+def make_synthetic_flight(path, duration=3600, frequency=8.0, param_count=100, seed=0, masked_fraction=0.01):
+    '''write an hdf5 flight of param_count random-walk series, duration seconds at frequency Hz'''
+    rng = np.random.RandomState(seed)
+    length = int(duration*frequency)
+    with h5py.File(path, 'w') as f:
+        f.create_group('series')
+    with hdf_file(path) as hdf:
+        hdf.duration = duration
+        hdf.start_datetime = START_DATETIME
+        for i in range(param_count):
+            data = np.cumsum(rng.randn(length))
+            mask = rng.rand(length) < masked_fraction
+            hdf.set_param(Parameter(series_name(i), array=np.ma.MaskedArray(data, mask=mask),
+                                    frequency=frequency, offset=0.0, units='ft'))
+    return path
+
+
+### synthetic profile: for each pair of series, a sum, its maximum and the time it first goes positive,
+### plus one phase.  Built with the same node classes as the real profiles.
+def _sum_node(i, a_name, b_name):
+    def derive(self, a=P(a_name), b=P(b_name)):
+        self.array = a.array + b.array
+    return type('SyntheticSum%03d' % i, (DerivedParameterNode,), {'name': 'Synthetic Sum %03d' % i, 'derive': derive})
+
+
+def _max_node(i, sum_name):
+    def derive(self, x=P(sum_name)):
+        index = np.ma.argmax(x.array)
+        self.create_kpv(index, x.array[index])
+    return type('SyntheticMax%03d' % i, (KeyPointValueNode,), {'name': 'Synthetic Max %03d' % i, 'derive': derive})
+
+
+def _positive_node(i, sum_name):
+    def derive(self, x=P(sum_name)):
+        positive = np.ma.where(x.array > 0)[0]
+        if len(positive):
+            self.create_kti(positive[0])
+    return type('SyntheticPositive%03d' % i, (KeyTimeInstanceNode,), {'name': 'Synthetic Positive %03d' % i, 'derive': derive})
+
+
+class SyntheticPhase(FlightPhaseNode):
+    name = 'Synthetic Phase'
+    def derive(self, x=P(series_name(0))):
+        length = len(x.array)
+        self.create_section(slice(length//4, 3*length//4))
+
+
+def synthetic_nodes(param_count):
+    '''{node name: node class} for the synthetic profile'''
+    nodes = [SyntheticPhase]
+    for i in range(param_count//2):
+        sum_node = _sum_node(i, series_name(2*i), series_name(2*i+1))
+        nodes += [sum_node, _max_node(i, sum_node.get_name()), _positive_node(i, sum_node.get_name())]
+    return dict((n.get_name(), n) for n in nodes)
+
+
+def node_manager(flight_path, derived_nodes):
+    with hdf_file(flight_path) as hdf:
+        series_keys = hdf.valid_param_names()[:]
+        duration = hdf.duration
+    return NodeManager(START_DATETIME, duration, series_keys, derived_nodes.keys(), derived_nodes, AIRCRAFT_INFO,
+                       achieved_flight_record={'Myfile':flight_path, 'Mydict':dict()})
+
+
+### local database stand-in
+def sqlite_standin():
+    '''in-memory database with the fds_sqlite tables'''
+    cn = sqlite3.connect(':memory:')
+    cn.execute(flight_record_spec.flight_record_ddl(dialect='sqlite'))
+    cn.executescript(fds_sqlite.SCHEMA)
+    return cn
+
+
+### timing
+def timed(run, setup=None, repeat=5):
+    '''seconds for each of repeat calls of run(setup()); setup is not timed'''
+    seconds = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.time()
+        run(state)
+        seconds.append(time.time()-start)
+    return seconds
+
+
+def result_record(name, case, seconds):
+    return {'benchmark': name, 'case': case, 'repeat': len(seconds),
+            'min': min(seconds), 'median': float(np.median(seconds)), 'mean': float(np.mean(seconds)),
+            'seconds': seconds, 'run_time': datetime.now().isoformat(), 'host': socket.gethostname(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'h5py': h5py.__version__,
+            'analyzer_version': analyzer_version}
+
+
+def run_benchmarks(work_dir, duration=3600, frequency=8.0, param_count=100, repeat=5, only=None):
+    '''run every benchmark (or those named in only) and return their result records'''
+    case = {'duration': duration, 'frequency': frequency, 'params': param_count}
+    flight_path = make_synthetic_flight(os.path.join(work_dir, 'synthetic_flight.hdf5'), duration, frequency, param_count)
+    derived_nodes = synthetic_nodes(param_count)
+    process_order, _ = dependency_order(node_manager(flight_path, derived_nodes), draw=False)
+    flight_dict = {'filepath': flight_path, 'aircraft_info': AIRCRAFT_INFO, 'repo': 'local'}
+
+    def fresh_copy():
+        '''derive_parameters_mitre writes derived series, so each repeat works on its own copy'''
+        copy_path = os.path.join(work_dir, 'synthetic_copy.hdf5')
+        shutil.copyfile(flight_path, copy_path)
+        return copy_path, node_manager(copy_path, derived_nodes)
+
+    def derive_mitre(state):
+        copy_path, node_mgr = state
+        with hdf_file(copy_path) as hdf:
+            return sh.derive_parameters_mitre(hdf, node_mgr, process_order, {})
+
+    def load_flight(state):
+        flight = sh.Flight()
+        flight.load_from_hdf5(flight_dict)
+        flight.preload()
+        return flight
+
+    def derive_series(flight):
+        sh.derive_parameters_series(flight, node_manager(flight_path, derived_nodes), process_order)
+
+    kti, kpv, phases, approach, flight_attrs, params = derive_mitre(fresh_copy())
+    store_path = os.path.join(work_dir, 'synthetic_flight'+sh.store_suffix())
+    sections = {'params': params, 'results': {'kti': kti, 'kpv': kpv, 'phases': phases}}
+
+    def pickle_round_trip(state):
+        pickle.loads(pickle.dumps(params, pickle.HIGHEST_PROTOCOL))
+
+    def store_round_trip(state):
+        flight_store.write_store(store_path, sections, analyzer_version)
+        flight_store.FlightStore(store_path, mmap=False).load_section('params')
+
+    def result_writer(cn):
+        with sh.ResultWriter(cn, batch_size=50) as writer:
+            for i in range(50):
+                writer.add_flight('benchmark', 'flight_%03d.hdf5' % i, flight_path, kti, kpv, phases, params, 'local')
+
+    def report_timing(cn):
+        for i in range(50):
+            sh.report_timing(datetime.now(), 'profile', 'benchmark', flight_path, 1.0, 'ok', sh.logger, cn)
+
+    benchmarks = [('load_from_hdf5',           load_flight,       None),
+                  ('derive_parameters_series', derive_series,     lambda: load_flight(None)),
+                  ('derive_parameters_mitre',  derive_mitre,      fresh_copy),
+                  ('pickle_round_trip',        pickle_round_trip, None),
+                  ('flight_store_round_trip',  store_round_trip,  None),
+                  ('result_writer_50_flights', result_writer,     sqlite_standin),
+                  ('report_timing_50_flights', report_timing,     sqlite_standin),
+                 ]
+    settings.PROFILE_REPORTS_PATH = work_dir+'/'  # report_timing csv goes to the scratch directory
+    records = []
+    for name, run, setup in benchmarks:
+        if only and name not in only:
+            continue
+        records.append(result_record(name, case, timed(run, setup, repeat)))
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark staged_helper on synthetic flights.')
+    parser.add_argument('--duration', type=int, default=3600, help='flight duration, seconds')
+    parser.add_argument('--frequency', type=float, default=8.0, help='series frequency, Hz')
+    parser.add_argument('--params', type=int, default=100, help='number of recorded series')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='*', help='names of the benchmarks to run')
+    parser.add_argument('--out', help='append JSON lines to this file instead of printing them')
+    args = parser.parse_args(argv)
+
+    work_dir = tempfile.mkdtemp(prefix='fds_benchmark_')
+    try:
+        records = run_benchmarks(work_dir, args.duration, args.frequency, args.params, args.repeat, args.only)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    out = open(args.out, 'a') if args.out else sys.stdout
+    try:
+        for rec in records:
+            out.write(json.dumps(rec) + '\n')
+    finally:
+        if args.out: out.close()
+
+
+if __name__=='__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Choice of results database: 'oracle' (fds_oracle) or 'sqlite' (fds_sqlite).
+
+Both modules provide get_connection, release_connection, close_pool, pooled_connection,
+insert_from_ordered_dict, iter_query and flight_record_filepaths.  The backend is imported on first
+use, so runs on the sqlite backend do not need cx_Oracle installed.
+
+@author: keithc
+"""
+import os, time, hashlib, tempfile, importlib
+import cPickle as pickle
+
+import analyser_custom_settings
+
+BACKENDS = {'oracle': 'fds_oracle', 'sqlite': 'fds_sqlite'}
+DEFAULT_BACKEND = getattr(analyser_custom_settings, 'DB_BACKEND', 'oracle')
+# flight_record_filepaths results are kept here for QUERY_CACHE_TTL seconds; no path or ttl: no cache
+QUERY_CACHE_PATH = getattr(analyser_custom_settings, 'QUERY_CACHE_PATH', None)
+QUERY_CACHE_TTL = getattr(analyser_custom_settings, 'QUERY_CACHE_TTL', None)
+
+
+def get_backend(name=None):
+    ''' the database module for name, or for analyser_custom_settings.DB_BACKEND (default oracle) '''
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError('unknown database backend '+repr(name)+'; expected one of '+str(sorted(BACKENDS)))
+    return importlib.import_module(BACKENDS[name])
+
+
+def cached_rows(key_parts, fetch, ttl=None, cache_dir=None):
+    ''' fetch() (a list), or its saved result if the same key_parts were fetched less than ttl seconds ago.
+        key_parts identify the result: database, query text, binds, limits.  ttl 0 or None fetches every time.
+    '''
+    ttl = QUERY_CACHE_TTL if ttl is None else ttl
+    cache_dir = cache_dir or QUERY_CACHE_PATH
+    if not ttl or not cache_dir:
+        return fetch()
+    key = hashlib.sha1(repr(key_parts)).hexdigest()
+    path = os.path.join(cache_dir, 'query_'+key+'.pkl')
+    if os.path.isfile(path) and time.time()-os.path.getmtime(path) < ttl:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    rows = fetch()
+    if not os.path.exists(cache_dir): 
+        try:
+            os.makedirs(cache_dir)
+        except OSError:  # made by another process meanwhile
+            if not os.path.isdir(cache_dir): raise
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', prefix='query_', dir=cache_dir)  # unique: concurrent runs do not collide
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(rows, f, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(path): os.remove(path)  # Windows will not rename over it
+        os.rename(tmp, path)
+    except OSError:  # another run saved the same query first; the cache is only a shortcut
+        if os.path.exists(tmp): os.remove(tmp)
+    return rows
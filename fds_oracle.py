@@ -2,30 +2,130 @@
 """
 Database routines -- Oracle 
 
+Connections are borrowed from a module-level session pool that is created
+lazily on first use.  Pool sizes can be set in analyser_custom_settings 
+(ORACLE_POOL_MIN, ORACLE_POOL_MAX, ORACLE_POOL_INCREMENT).  A connection string
+that is not user/password@server (e.g. /@server for OS authentication) is not pooled:
+each get_connection() then opens its own connection with cx_Oracle.connect.
+
+Queries are read with iter_query(), a generator that fetches ORACLE_ARRAYSIZE rows per 
+round trip and can have the server limit (rownum) or sample (dbms_random) the rows.
+
 @author: keithc
 """
+import os
+from contextlib import contextmanager
+
 import analyser_custom_settings
 import cx_Oracle as ora
 
-def get_connection():
-    ''' connect to Oracle
-    
-        connection.txt should contain a single connection string,
+import fds_db
+
+POOL_MIN       = getattr(analyser_custom_settings, 'ORACLE_POOL_MIN', 1)
+POOL_MAX       = getattr(analyser_custom_settings, 'ORACLE_POOL_MAX', 4)
+POOL_INCREMENT = getattr(analyser_custom_settings, 'ORACLE_POOL_INCREMENT', 1)
+ARRAYSIZE      = getattr(analyser_custom_settings, 'ORACLE_ARRAYSIZE', 1000)  # rows per fetch round trip
+
+_pool = None
+_pool_pid = None  # a pool must not be shared with a forked child process
+
+
+def get_connection_string():
+    ''' connection.txt should contain a single connection string,
         e.g. scott/tiger@servername   (username/password@server)
         
         The server needs to have been previously configured in Oracle client,
           for example using a TNSnames entry or an LDAP connection.
     '''
     with open(analyser_custom_settings.SHARED_CODE_PATH+'connection.txt') as f:
-        connection_string = f.read()
-        
-    cn = ora.connect(connection_string)
+        connection_string = f.read().strip()
+    return connection_string
+
+
+def split_connection_string(connection_string):
+    ''' (user, password, server) of user/password@server, or None for any other form '''
+    if '/' not in connection_string or '@' not in connection_string:
+        return None
+    user, rest = connection_string.split('/', 1)
+    password, dsn = rest.rsplit('@', 1)
+    if not (user and password and dsn):
+        return None
+    return user, password, dsn
+
+
+def get_pool():
+    ''' return the session pool, creating it on first use in this process.
+        None if the connection string cannot be pooled (see split_connection_string)
+    '''
+    global _pool, _pool_pid
+    if _pool_pid != os.getpid():
+        parts = split_connection_string(get_connection_string())
+        _pool = None
+        if parts:
+            user, password, dsn = parts
+            _pool = ora.SessionPool(user, password, dsn, POOL_MIN, POOL_MAX, POOL_INCREMENT, 
+                                    threaded=True, getmode=ora.SPOOL_ATTRVAL_WAIT)
+        _pool_pid = os.getpid()
+    return _pool
+
+
+def close_pool():
+    ''' close all pooled sessions, e.g. at the end of a script '''
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.close()
+    _pool = None
+    _pool_pid = None
+
+
+def get_connection():
+    ''' borrow a connection from the session pool.  Hand it back with release_connection().
+        Sessions that fail a ping (e.g. after a network drop) are discarded and replaced.
+    '''
+    pool = get_pool()
+    if pool is None:
+        return ora.connect(get_connection_string(), threaded=True)
+    cn = pool.acquire()
+    try:
+        cn.ping()
+    except ora.Error:
+        pool.drop(cn)
+        cn = pool.acquire()
     return cn 
 
+
+def release_connection(cn):
+    ''' return a borrowed connection to the session pool, or close it if there is no pool '''
+    pool = get_pool()
+    try:
+        cn.rollback()  # never hand back uncommitted work
+        if pool is None:
+            cn.close()
+        else:
+            pool.release(cn)
+    except ora.Error:
+        try:
+            if pool is None:
+                cn.close()
+            else:
+                pool.drop(cn)
+        except ora.Error:
+            pass
+
+
+@contextmanager
+def pooled_connection():
+    ''' with pooled_connection() as cn:  borrow a connection for the duration of the block '''
+    cn = get_connection()
+    try:
+        yield cn
+    finally:
+        release_connection(cn)
+
     
 def insert_from_ordered_dict(my_record, table):
     '''appends a recond to Oracle from an OrderedDict.  It does NOT check integrity or uniqueness!'''
-    with get_connection() as cn:
+    with pooled_connection() as cn:
         cur =cn.cursor()
         cols = ','.join(my_record.keys())
         colsyms = ','.join([':'+k for k in my_record.keys()])
@@ -35,16 +135,50 @@ def insert_from_ordered_dict(my_record, table):
         cur.close()
 
 
-def flight_record_filepaths(query):
-    '''Pass query like 'select file_path from fds_flight_record where ...'
-       Get back a list of files to process in your profile
+def limited_query(query, max_rows=None, sample=None):
+    ''' wrap query so the server returns at most max_rows rows, and (with sample, a fraction 0-1) 
+        a random sample of about that fraction of its rows, in random order.
+        Adds the binds :sample_fraction and :max_rows.
     '''
-    with get_connection() as cn:
-        cur = cn.cursor()
-        cur.execute(query)       
-        files_to_process = [fld[0] for fld in cur.fetchall()]
-        cur.close()
-    return files_to_process
+    if sample is not None:
+        query = 'select * from (\n' + query + '\n) where dbms_random.value < :sample_fraction order by dbms_random.value'
+    if max_rows is not None:
+        query = 'select * from (\n' + query + '\n) where rownum <= :max_rows'
+    return query
+
 
+def iter_query(query, params=None, arraysize=ARRAYSIZE, max_rows=None, sample=None):
+    ''' generator of the rows of query, fetched arraysize rows at a time.
+        params is a dict of named binds.  See limited_query for max_rows and sample.
+        The pooled connection is held until the rows are exhausted or the generator is closed.
+    '''
+    binds = dict(params or {})
+    if sample is not None: binds['sample_fraction'] = sample
+    if max_rows is not None: binds['max_rows'] = max_rows
+    with pooled_connection() as cn:
+        cur = cn.cursor()
+        try:
+            cur.arraysize = arraysize
+            cur.execute(limited_query(query, max_rows, sample), binds)
+            while True:
+                rows = cur.fetchmany()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cur.close()
 
 
+def flight_record_filepaths(query, params=None, max_rows=None, sample=None, arraysize=ARRAYSIZE, cache_ttl=None):
+    '''Pass query like 'select file_path from fds_flight_record where ...'
+       Get back a list of files to process in your profile.
+       max_rows and sample are applied by the server (see limited_query); with cache_ttl 
+       (default QUERY_CACHE_TTL) the list is saved on disk and reused for that many seconds.
+    '''
+    def fetch():
+        return [fld[0] for fld in iter_query(query, params, arraysize, max_rows, sample)]
+    connection_string = get_connection_string()
+    database = connection_string.split('/', 1)[0] + '@' + connection_string.rsplit('@', 1)[-1]  # no password in the key
+    return fds_db.cached_rows(('oracle', database, query, sorted((params or {}).items()), max_rows, sample), 
+                              fetch, cache_ttl)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar export of flight measures -- Parquet
+
+KTI, KPV and phase rows (as built by staged_helper.kti_rows, kpv_rows and phase_rows)
+and flight records are written as compressed Parquet datasets, one per table, under
+analyser_custom_settings.PARQUET_EXPORT_PATH:
+
+    <root>/fds_kpv/profile=<profile>/run_date=<yyyy-mm-dd>/<part>.parquet
+
+Columns are typed (text, float64, timestamp), so readers get numbers back rather than
+strings.  read_measures() reads only the requested columns, and filters on profile and
+run_date skip whole directories.  For example, fleet-wide maxima of one KPV:
+
+    df = read_measures('fds_kpv', columns=['name', 'value'],
+                       filters=[('profile', '=', 'base'), ('run_date', '>=', '2013-06-01')])
+    df[df.name=='Airspeed Max'].value.describe()
+
+Needs pyarrow (and pandas for read_measures); they are imported only when used.
+
+@author: keithc
+"""
+import os
+from collections import OrderedDict
+
+import analyser_custom_settings
+import flight_record_spec
+
+EXPORT_PATH = getattr(analyser_custom_settings, 'PARQUET_EXPORT_PATH', None)
+PARTITION_COLS = ['profile', 'run_date']
+
+# column names and types, in the order of the row lists built by staged_helper
+MEASURE_COLUMNS = {
+    'fds_kti':   [('profile','string'), ('source_file','string'), ('name','string'), ('time_index','float64'),
+                  ('base_file_path','string'), ('file_repository','string')],
+    'fds_kpv':   [('profile','string'), ('source_file','string'), ('name','string'), ('time_index','float64'),
+                  ('value','float64'), ('base_file_path','string'), ('units','string'), ('file_repository','string')],
+    'fds_phase': [('profile','string'), ('source_file','string'), ('name','string'), ('time_index','float64'),
+                  ('stop_edge','float64'), ('duration','float64'), ('base_file_path','string'), ('file_repository','string')],
+}
+# arrow types for the column types of flight_record_spec, so every part file of fds_flight_record has one schema
+RECORD_TYPES = {'varchar2': 'string', 'clob': 'string', 'number': 'float64', 'timestamp': 'timestamp'}
+
+
+def _arrow_type(type_name):
+    import pyarrow as pa
+    return pa.timestamp('us') if type_name=='timestamp' else getattr(pa, type_name)()
+
+
+def _arrow_table(columns, run_date):
+    '''pyarrow Table from an OrderedDict of name -> (type name, values)'''
+    import pyarrow as pa
+    arrays, names = [], []
+    for name, (type_name, values) in columns.items():
+        arrays.append(pa.array(values, type=_arrow_type(type_name)))
+        names.append(name)
+    length = len(arrays[0]) if arrays else 0
+    arrays.append(pa.array([run_date]*length, type=pa.string()))
+    names.append('run_date')
+    return pa.Table.from_arrays(arrays, names)
+
+
+def rows_to_table(table, rows, run_date):
+    '''typed pyarrow Table from row lists of one of the MEASURE_COLUMNS tables'''
+    spec = MEASURE_COLUMNS[table]
+    columns = OrderedDict((name, (type_name, [row[i] for row in rows])) for i, (name, type_name) in enumerate(spec))
+    return _arrow_table(columns, run_date)
+
+
+def records_to_table(records, run_date):
+    '''pyarrow Table from (profile, flight record OrderedDict) pairs, with the columns and types 
+       of flight_record_spec.flight_record_columns(); numbers are float64, missing values null'''
+    columns = OrderedDict([('profile', ('string', [profile for profile, _ in records]))])
+    for name, column_type in flight_record_spec.flight_record_columns():
+        type_name = RECORD_TYPES[column_type.split('(')[0]]
+        values = [rec.get(name) for _, rec in records]
+        if type_name=='float64':
+            values = [None if v is None else float(v) for v in values]
+        columns[name] = (type_name, values)
+    return _arrow_table(columns, run_date)
+
+
+def write_table(table_name, arrow_table, root=None, compression='snappy'):
+    '''add one part file per profile and run date to the dataset for table_name'''
+    import pyarrow.parquet as pq
+    root = root or EXPORT_PATH
+    pq.write_to_dataset(arrow_table, os.path.join(root, table_name), partition_cols=PARTITION_COLS,
+                        compression=compression)
+
+
+def read_measures(table_name, root=None, columns=None, filters=None):
+    '''pandas DataFrame of the requested columns (default: all) of one exported table.
+       filters are pyarrow (column, op, value) tuples, e.g. [('profile', '=', 'base')];
+       filters on profile and run_date skip the other partition directories unread.
+    '''
+    import pyarrow.parquet as pq
+    root = root or EXPORT_PATH
+    dataset = pq.ParquetDataset(os.path.join(root, table_name), filters=filters)
+    return dataset.read(columns=columns).to_pandas()
+
+
+class MeasuresExport(object):
+    '''Collects KTI/KPV/phase rows and flight records over many flights, and writes them
+       as one Parquet part file per table and partition every batch_size flights.
+       Use it as a context manager, or call close(), so the last batch is written.
+    '''
+    def __init__(self, run_date, root=None, batch_size=200, compression='snappy'):
+        self.run_date = run_date.strftime('%Y-%m-%d') if hasattr(run_date, 'strftime') else str(run_date)
+        self.root = root or EXPORT_PATH
+        self.batch_size = batch_size
+        self.compression = compression
+        self.rows = dict((table, []) for table in MEASURE_COLUMNS)
+        self.records = []
+        self.flights = 0
+
+    def add_flight(self, profile, kti_rows, kpv_rows, phase_rows, flight_record=None):
+        self.rows['fds_kti'] += kti_rows
+        self.rows['fds_kpv'] += kpv_rows
+        self.rows['fds_phase'] += phase_rows
+        if flight_record:
+            self.records.append((profile, flight_record))
+        self.flights += 1
+        if self.flights>=self.batch_size:
+            self.flush()
+
+    def flush(self):
+        for table, rows in self.rows.items():
+            if rows:
+                write_table(table, rows_to_table(table, rows, self.run_date), self.root, self.compression)
+        if self.records:
+            write_table('fds_flight_record', records_to_table(self.records, self.run_date), self.root, self.compression)
+        self.rows = dict((table, []) for table in MEASURE_COLUMNS)
+        self.records = []
+        self.flights = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""
+Database routines -- SQLite
+
+An embedded, file-based copy of the fds_* tables in asias_fds_oracle.sql, with the same
+functions as fds_oracle, so laptop and offline runs keep their results.  The database
+file is analyser_custom_settings.SQLITE_DB_PATH; tables and indexes are created on
+first use.  Select it with DB_BACKEND = 'sqlite' (see fds_db.get_backend).
+
+The Oracle-style SQL in staged_helper runs unchanged: sqlite accepts :name bind
+variables (by name or by position) and ignores the /*append*/ hints.
+
+@author: keithc
+"""
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+
+import analyser_custom_settings
+import fds_db
+import flight_record_spec
+
+DB_PATH = getattr(analyser_custom_settings, 'SQLITE_DB_PATH',
+                  os.path.join(getattr(analyser_custom_settings, 'PROFILE_DATA_PATH', ''), 'fds_results.sqlite'))
+BUSY_TIMEOUT = 60.  # seconds to wait for another process's write to finish
+ARRAYSIZE = 1000     # rows per fetchmany in iter_query
+
+# numpy scalars are not all ints/floats to sqlite3 (e.g. int64 on Windows)
+for _t in (np.int8, np.int16, np.int32, np.int64, np.uint8, np.uint16, np.uint32, np.bool_):
+    sqlite3.register_adapter(_t, int)
+for _t in (np.float16, np.float32, np.float64):
+    sqlite3.register_adapter(_t, float)
+
+SCHEMA = """
+create table if not exists fds_jobs (
+    run_time timestamp, stage text, profile text, cmt text, input_path text, output_path text,
+    file_count integer, processing_seconds real, skipped_count integer
+);
+create table if not exists fds_kti (
+    profile text, source_file text, name text, time_index real, latitude real, longitude real,
+    base_file_path text, file_repository text
+);
+create table if not exists fds_phase (
+    profile text, source_file text, name text, time_index real, duration real, stop_edge real,
+    base_file_path text, file_repository text, profile_set text
+);
+create table if not exists fds_kpv (
+    profile text, source_file text, name text, time_index real, value real,
+    base_file_path text, units text, file_repository text, profile_set text
+);
+create table if not exists fds_convert (
+    run_time timestamp, source_file text, fleet_family text, fleet_series text, tail_number text, lfl text,
+    output_file text, status text, file_size_meg real, flight_hours real, conversion_seconds real
+);
+create table if not exists fds_processing_time (
+    run_time timestamp, source_file text, stage text, profile text, file_size_meg real,
+    processing_seconds real, status text, epoch real, cmt text
+);
+create table if not exists fds_node_timing (
+    run_time timestamp, stage text, profile text, source_file text, node_name text, node_type text,
+    deps_seconds real, derive_seconds real, input_bytes integer, output_bytes integer, output_count integer
+);
+
+-- the per-flight deletes in staged_helper, and the usual report queries
+create index if not exists fds_kti_flight   on fds_kti (file_repository, source_file, profile);
+create index if not exists fds_kpv_flight   on fds_kpv (file_repository, source_file, profile);
+create index if not exists fds_phase_flight on fds_phase (file_repository, source_file, profile);
+create index if not exists fds_kti_name     on fds_kti (profile, name);
+create index if not exists fds_kpv_name     on fds_kpv (profile, name);
+create index if not exists fds_phase_name   on fds_phase (profile, name);
+create index if not exists fds_flight_record_repo  on fds_flight_record (file_repository, source_file);
+create index if not exists fds_flight_record_route on fds_flight_record (orig_icao, dest_icao);
+create index if not exists fds_processing_time_run on fds_processing_time (run_time, profile);
+create index if not exists fds_node_timing_name    on fds_node_timing (profile, node_name);
+"""
+
+_initialized = set()  # database files whose schema has been checked by this process
+
+
+def init_db(path=DB_PATH):
+    ''' create the tables and indexes if they do not exist yet '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory): os.makedirs(directory)
+    cn = sqlite3.connect(path, timeout=BUSY_TIMEOUT)
+    try:
+        cn.execute('pragma journal_mode=WAL')  # readers do not block the writer; persists in the file
+        # fds_flight_record follows flight_record_spec; columns added to the spec are added to the table
+        cn.execute(flight_record_spec.flight_record_ddl(dialect='sqlite'))
+        existing = [row[1] for row in cn.execute('pragma table_info(fds_flight_record)')]
+        for alter in flight_record_spec.missing_columns_ddl(existing, dialect='sqlite'):
+            cn.execute(alter)
+        cn.executescript(SCHEMA)
+        cn.commit()
+    finally:
+        cn.close()
+    _initialized.add(path)
+
+
+def get_connection(path=DB_PATH):
+    ''' open a connection to the results database.  Hand it back with release_connection().
+        It may be used from a ReportSink thread, so it is not tied to the opening thread.
+    '''
+    if path not in _initialized:
+        init_db(path)
+    cn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                         detect_types=sqlite3.PARSE_DECLTYPES)
+    cn.execute('pragma synchronous=NORMAL')  # with WAL: durable at checkpoints, much faster commits
+    cn.execute('pragma temp_store=MEMORY')
+    cn.execute('pragma cache_size=-65536')   # 64MB page cache
+    return cn
+
+
+def release_connection(cn):
+    ''' close a connection from get_connection(), discarding uncommitted work '''
+    try:
+        cn.rollback()
+    finally:
+        cn.close()
+
+
+def close_pool():
+    ''' nothing to do; connections are not pooled.  Kept so callers can treat both backends alike '''
+    pass
+
+
+@contextmanager
+def pooled_connection(path=DB_PATH):
+    ''' with pooled_connection() as cn:  a connection for the duration of the block '''
+    cn = get_connection(path)
+    try:
+        yield cn
+    finally:
+        release_connection(cn)
+
+
+@contextmanager
+def bulk_load(cn):
+    ''' with bulk_load(cn):  for large loads, e.g. importing a whole results csv.
+        Skips fsync until the block ends and commits once at the end;
+        a crash during the block can lose the rows written in it.
+    '''
+    cn.execute('pragma synchronous=OFF')
+    try:
+        yield cn
+        cn.commit()
+    except:
+        cn.rollback()
+        raise
+    finally:
+        cn.execute('pragma synchronous=NORMAL')
+
+
+def insert_from_ordered_dict(my_record, table):
+    '''appends a recond from an OrderedDict.  It does NOT check integrity or uniqueness!'''
+    with pooled_connection() as cn:
+        cols = ','.join(my_record.keys())
+        colsyms = ','.join([':'+k for k in my_record.keys()])
+        isql = """insert into TABLE(COLS) values (SYMS)""".replace('TABLE',table).replace('COLS',cols).replace('SYMS',colsyms)
+        cn.execute(isql, my_record.values())
+        cn.commit()
+
+
+def insert_many(records, table):
+    '''appends many OrderedDicts with the same keys in one transaction'''
+    if not records:
+        return
+    with pooled_connection() as cn:
+        with bulk_load(cn):
+            cols = records[0].keys()
+            isql = """insert into TABLE(COLS) values (SYMS)""".replace('TABLE',table).replace('COLS',','.join(cols)).replace('SYMS',','.join([':'+k for k in cols]))
+            cn.executemany(isql, [[rec.get(k) for k in cols] for rec in records])
+
+
+def limited_query(query, max_rows=None, sample=None):
+    ''' as fds_oracle.limited_query, with sqlite's random() and limit '''
+    if sample is not None:
+        query = 'select * from (\n' + query + '\n) where (random() / 18446744073709551616.0 + 0.5) < :sample_fraction order by random()'
+    if max_rows is not None:
+        query = 'select * from (\n' + query + '\n) limit :max_rows'
+    return query
+
+
+def iter_query(query, params=None, arraysize=ARRAYSIZE, max_rows=None, sample=None):
+    ''' generator of the rows of query, fetched arraysize rows at a time.  See fds_oracle.iter_query '''
+    binds = dict(params or {})
+    if sample is not None: binds['sample_fraction'] = sample
+    if max_rows is not None: binds['max_rows'] = max_rows
+    with pooled_connection() as cn:
+        cur = cn.execute(limited_query(query, max_rows, sample), binds)
+        try:
+            while True:
+                rows = cur.fetchmany(arraysize)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cur.close()
+
+
+def flight_record_filepaths(query, params=None, max_rows=None, sample=None, arraysize=ARRAYSIZE, cache_ttl=None):
+    '''Pass query like 'select file_path from fds_flight_record where ...'
+       Get back a list of files to process in your profile.  See fds_oracle.flight_record_filepaths
+    '''
+    def fetch():
+        return [fld[0] for fld in iter_query(query, params, arraysize, max_rows, sample)]
+    return fds_db.cached_rows(('sqlite', os.path.abspath(DB_PATH), query, sorted((params or {}).items()), max_rows, sample),
+                              fetch, cache_ttl)
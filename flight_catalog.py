@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+flight_catalog : a local index of flight files, to replace glob scans of the shares.
+
+Listing a directory of 100k flights on //serrano takes minutes; asking this catalog
+takes milliseconds.  The catalog is a sqlite file (analyser_custom_settings.FLIGHT_CATALOG_PATH)
+with one row per file: path, size, mtime, tail number and frame (from the file name,
+via fleets.frame_list), flight date (from the file name, FLIGHT_DATE_PATTERN) and repository.
+
+scan() relists a directory only when the directory mtime has changed since its last scan,
+and then stats only the files it has not seen before.  A file rewritten in place does not
+change its directory's mtime; use scan(..., force=True) after reprocessing a directory.
+Every directory is catalogued for the same broad pattern (FLIGHT_CATALOG_PATTERN); a caller's
+own file name pattern is applied by files(), so callers with different patterns share one scan.
+
+    cat = FlightCatalog()
+    cat.scan('Y:/asias_fds/base_data/test10/', 'serrano')
+    files = cat.files(repository='serrano', frame='A320_SFIM_ED45_CFM', date_from='2013-06-01', pattern='*.hdf5')
+
+or from the command line, to refresh the catalog for a share before a run:
+
+    python flight_catalog.py Y:/asias_fds/base_data/test10/ serrano [--force]
+
+@author: keithc
+"""
+import os, re, sys, stat, time, fnmatch, logging, sqlite3
+
+import analyser_custom_settings
+
+CATALOG_PATH = getattr(analyser_custom_settings, 'FLIGHT_CATALOG_PATH', None)
+# the first yyyymmdd (or yyyy-mm-dd, yyyy_mm_dd) in a file name is its flight date
+FLIGHT_DATE_PATTERN = getattr(analyser_custom_settings, 'FLIGHT_DATE_PATTERN', r'((?:19|20)\d\d)[-_]?(\d\d)[-_]?(\d\d)')
+# file names catalogued in every directory; narrower patterns are applied when querying
+CATALOG_PATTERN = getattr(analyser_custom_settings, 'FLIGHT_CATALOG_PATTERN', '*')
+MTIME_SLACK = 2.  # seconds; a directory changed this close to its last scan is relisted (coarse share timestamps)
+BUSY_TIMEOUT = 60.
+
+SCHEMA = """
+create table if not exists catalog_dirs (
+    directory text primary key, repository text, pattern text, mtime real, scanned real, file_count integer
+);
+create table if not exists catalog_files (
+    path text primary key, directory text, file_name text, repository text, size integer, mtime real,
+    tail_number text, frame text, flight_date text
+);
+create index if not exists catalog_files_dir    on catalog_files (directory);
+create index if not exists catalog_files_tail   on catalog_files (tail_number);
+create index if not exists catalog_files_frame  on catalog_files (frame);
+create index if not exists catalog_files_date   on catalog_files (flight_date);
+create index if not exists catalog_files_size   on catalog_files (size);
+create index if not exists catalog_files_repo   on catalog_files (repository);
+"""
+
+
+def _dir_key(directory):
+    '''one spelling per directory: Y:/a/b/, Y:\\a\\b and y:/a/b are the same'''
+    return os.path.normcase(os.path.normpath(directory))
+
+
+def flight_date(file_name, pattern=FLIGHT_DATE_PATTERN):
+    '''yyyy-mm-dd from the file name, or None'''
+    m = re.search(pattern, file_name)
+    return '-'.join(m.groups()[:3]) if m else None
+
+
+class FlightCatalog(object):
+    '''sqlite index of flight files; see the module docstring'''
+    def __init__(self, path=None, frame_dict=None):
+        self.path = path or CATALOG_PATH
+        if not self.path:
+            raise ValueError('no catalog path: set analyser_custom_settings.FLIGHT_CATALOG_PATH')
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory): os.makedirs(directory)
+        self.cn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        self.cn.text_factory = str  # byte-string paths, like glob.glob
+        self.cn.execute('pragma journal_mode=WAL')
+        self.cn.executescript(SCHEMA)
+        self._frame_dict = frame_dict
+
+    def frame_dict(self):
+        '''tail number -> aircraft info, built on first use: only new files need it'''
+        if self._frame_dict is None:
+            import fleets.frame_list as frame_list
+            self._frame_dict = frame_list.build_frame_list(logging.getLogger())
+        return self._frame_dict
+
+    def _file_row(self, directory, key, file_name, repository):
+        path = os.path.join(directory, file_name)
+        st = os.stat(path)
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        try:
+            from fleets.frame_list import get_info_from_filename
+            _, _, _, registration = get_info_from_filename(file_name, self.frame_dict())
+            frame = self.frame_dict()[registration]['Frame']
+        except Exception:  # unknown tail or unexpected name: still catalogued, just not by tail/frame
+            registration, frame = None, None
+        return (path, key, file_name, repository, st.st_size, st.st_mtime, registration, frame, flight_date(file_name))
+
+    def scan(self, directory, repository='local', force=False):
+        '''bring the catalog up to date for the files matching CATALOG_PATTERN in directory.
+           returns (added, removed) file counts; (0, 0) without listing if the directory is unchanged.
+        '''
+        key = _dir_key(directory)
+        dir_mtime = os.stat(directory).st_mtime
+        known = self.cn.execute('select mtime, scanned, pattern from catalog_dirs where directory=?', (key,)).fetchone()
+        if (known and not force and known[2]==CATALOG_PATTERN 
+                and known[0]==dir_mtime and known[1]-dir_mtime>MTIME_SLACK):
+            return 0, 0
+        scan_time = time.time()
+        names = set(n for n in os.listdir(directory) if fnmatch.fnmatch(n, CATALOG_PATTERN))
+        catalogued = set(r[0] for r in self.cn.execute('select file_name from catalog_files where directory=?', (key,)))
+        removed = catalogued - names
+        to_stat = names if force else names - catalogued
+        rows = []
+        for name in sorted(to_stat):
+            try:
+                row = self._file_row(directory, key, name, repository)
+            except OSError:  # deleted since the listing
+                row = None
+            if row is None:  # gone, or a subdirectory
+                removed.add(name)
+            else:
+                rows.append(row)
+        with self.cn:
+            self.cn.executemany('delete from catalog_files where directory=? and file_name=?', [(key, n) for n in removed])
+            self.cn.executemany('insert or replace into catalog_files values (?,?,?,?,?,?,?,?,?)', rows)
+            self.cn.execute('insert or replace into catalog_dirs values (?,?,?,?,?,?)',
+                            (key, repository, CATALOG_PATTERN, dir_mtime, scan_time, len(names - removed)))
+        return len(names - removed - catalogued), len(removed & catalogued)
+
+    def files(self, directory=None, repository=None, tail_number=None, frame=None,
+              date_from=None, date_to=None, min_size=None, max_size=None, pattern=None, limit=None):
+        '''sorted paths of catalogued files matching all the given conditions.
+           dates are 'yyyy-mm-dd', inclusive; sizes are bytes; pattern is a file name wildcard.
+           With directory, paths are joined to directory as given, as glob.glob would return them.
+        '''
+        conditions = [('directory=?', directory and _dir_key(directory)), ('repository=?', repository),
+                      ('tail_number=?', tail_number), ('frame=?', frame),
+                      ('flight_date>=?', date_from), ('flight_date<=?', date_to),
+                      ('size>=?', min_size), ('size<=?', max_size)]
+        conditions = [(sql, value) for sql, value in conditions if value is not None]
+        query = 'select path, file_name from catalog_files'
+        if conditions:
+            query += ' where ' + ' and '.join(sql for sql, _ in conditions)
+        query += ' order by path'
+        rows = self.cn.execute(query, [value for _, value in conditions])
+        if pattern:
+            rows = (r for r in rows if fnmatch.fnmatch(r[1], pattern))
+        paths = [os.path.join(directory, r[1]) if directory else r[0] for r in rows]
+        return paths[:limit] if limit else paths
+
+    def close(self):
+        self.cn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+def catalog_files(directory, pattern='*.hdf5', repository='local', path=None):
+    '''drop-in for glob.glob(os.path.join(directory, pattern)): rescan if changed, then query'''
+    with FlightCatalog(path) as cat:
+        cat.scan(directory, repository)
+        return cat.files(directory=directory, pattern=pattern)
+
+
+if __name__=='__main__':
+    args = [a for a in sys.argv[1:] if a!='--force']
+    if not args:
+        print 'usage: python flight_catalog.py directory [repository] [--force]'
+        sys.exit(1)
+    args += ['local'][len(args)-1:]
+    with FlightCatalog() as cat:
+        start = time.time()
+        added, removed = cat.scan(args[0], args[1], force='--force' in sys.argv)
+        print args[0], ': added', added, 'removed', removed, 'in', round(time.time()-start, 2), 'seconds'
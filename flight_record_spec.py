@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+flight_record_spec : declarative summary of one flight, for fds_flight_record.
+
+Each FLIGHT_RECORD_SPEC entry is (column, source, key, how, column type):
+
+    source 'context'   key names a value passed in by the caller (file names, tail number ...)
+    source 'const'     key is the value itself
+    source 'attr'      key is a path into a flight attribute value, e.g. ('FDR Takeoff Airport', 'code', 'icao');
+                       how is the value used when the attribute is missing or empty
+    source 'kti'       key is a KTI name; how is min, max, first, last (of the index) or count
+    source 'kpv'       key is a KPV name; how is min, max, first, last (of the value) or count
+    source 'approach'  key is an approach type (LANDING, GO_AROUND, TOUCH_AND_GO); how is count
+
+summarize_flight() evaluates the whole spec in one pass over the KTIs, KPVs, approaches
+and flight attributes, and flight_record_ddl() gives the matching table definition, so a
+new summary column is one new line here.  To print the Oracle DDL:
+
+    python flight_record_spec.py
+
+@author: keithc
+"""
+from collections import OrderedDict
+
+FLIGHT_RECORD_SPEC = [
+    # column                source      key                                         how        column type
+    ('file_repository',     'context',  'file_repository',                          None,      'varchar2(128)'),
+    ('source_file',         'context',  'source_file',                              None,      'varchar2(128)'),
+    ('file_path',           'context',  'file_path',                                None,      'varchar2(96)'),
+    ('base_file_path',      'context',  'base_file_path',                           None,      'varchar2(96)'),
+    ('tail_number',         'context',  'tail_number',                              None,      'varchar2(32)'),
+    ('fleet_series',        'context',  'fleet_series',                             None,      'varchar2(32)'),
+    ('operator',            'const',    'xxx',                                      None,      'varchar2(128)'),
+    ('analyzer_version',    'attr',     ('FDR Version',),                           '',        'varchar2(16)'),
+    ('flight_type',         'attr',     ('FDR Flight Type',),                       '',        'varchar2(128)'),
+    ('analysis_time',       'attr',     ('FDR Analysis Datetime',),                 None,      'timestamp'),
+    ('liftoff_min',         'kti',      'Liftoff',                                  'min',     'number'),
+    ('top_of_climb_min',    'kti',      'Top of Climb',                             'min',     'number'),
+    ('top_of_descent_min',  'kti',      'Top of Descent',                           'min',     'number'),
+    ('touchdown_min',       'kti',      'Touchdown',                                'min',     'number'),
+    ('duration',            'attr',     ('FDR Duration',),                          None,      'number'),
+    ('orig_icao',           'attr',     ('FDR Takeoff Airport', 'code', 'icao'),    '',        'varchar2(5)'),
+    ('orig_iata',           'attr',     ('FDR Takeoff Airport', 'code', 'iata'),    '',        'varchar2(5)'),
+    ('orig_elevation',      'attr',     ('FDR Takeoff Airport', 'elevation'),       None,      'number'),
+    ('orig_rwy',            'attr',     ('FDR Takeoff Runway', 'identifier'),       '',        'varchar2(5)'),
+    ('orig_rwy_length',     'attr',     ('FDR Takeoff Runway', 'strip', 'length'),  None,      'number'),
+    ('dest_icao',           'attr',     ('FDR Landing Airport', 'code', 'icao'),    '',        'varchar2(5)'),
+    ('dest_iata',           'attr',     ('FDR Landing Airport', 'code', 'iata'),    '',        'varchar2(5)'),
+    ('dest_elevation',      'attr',     ('FDR Landing Airport', 'elevation'),       None,      'number'),
+    ('dest_rwy',            'attr',     ('FDR Landing Runway', 'identifier'),       '',        'varchar2(5)'),
+    ('dest_rwy_length',     'attr',     ('FDR Landing Runway', 'strip', 'length'),  None,      'number'),
+    ('glideslope_angle',    'attr',     ('FDR Landing Runway', 'glideslope', 'angle'), None,   'number'),
+    ('landing_count',       'approach', 'LANDING',                                  'count',   'number'),
+    ('go_around_count',     'approach', 'GO_AROUND',                                'count',   'number'),
+    ('touch_and_go_count',  'approach', 'TOUCH_AND_GO',                             'count',   'number'),
+    ('other_json',          'const',    '',                                         None,      'varchar2(4000)'),
+]
+
+# filled in after summarize_flight(), by staged_helper.prepare_flight_record
+LATER_COLUMNS = [('recorded_parameters', 'clob')]
+PRIMARY_KEY = 'source_file'
+
+SQLITE_TYPES = {'varchar2': 'text', 'clob': 'text', 'number': 'numeric', 'timestamp': 'timestamp'}
+
+
+class _Aggregate(object):
+    '''running min/max/first/last/count of (index, value) pairs'''
+    __slots__ = ('how', 'count', 'result', 'at')
+
+    def __init__(self, how):
+        self.how = how
+        self.count = 0
+        self.result = None
+        self.at = None  # index of the current first/last value
+
+    def add(self, index, value):
+        self.count += 1
+        how = self.how
+        if how=='min':
+            if self.result is None or value<self.result: self.result = value
+        elif how=='max':
+            if self.result is None or value>self.result: self.result = value
+        elif how=='first':
+            if self.at is None or index<self.at: self.at, self.result = index, value
+        elif how=='last':
+            if self.at is None or index>=self.at: self.at, self.result = index, value
+
+    def value(self):
+        return self.count if self.how=='count' else self.result
+
+
+def _attr_value(attrs, path, default):
+    if path[0] not in attrs:
+        return default
+    value = attrs[path[0]]
+    if len(path)==1:
+        return value
+    if not value:  # e.g. 'FDR Takeoff Airport' is None
+        return default
+    for key in path[1:]:
+        value = value.get(key) if value else None
+    return value
+
+
+def summarize_flight(context, flight_attrs, kti, kpv, approach, spec=FLIGHT_RECORD_SPEC):
+    '''OrderedDict of column -> value, in spec order, from a single pass over each list'''
+    kti_aggs, kpv_aggs, approach_aggs = {}, {}, {}
+    by_source = {'kti': kti_aggs, 'kpv': kpv_aggs, 'approach': approach_aggs}
+    aggregates = {}
+    attr_names = set()
+    for column, source, key, how, _ in spec:
+        if source in by_source:
+            aggregates[column] = _Aggregate(how)
+            by_source[source].setdefault(key, []).append(aggregates[column])
+        elif source=='attr':
+            attr_names.add(key[0])
+
+    for k in kti:
+        for agg in kti_aggs.get(k.name, ()):
+            agg.add(k.index, k.index)
+    for k in kpv:
+        for agg in kpv_aggs.get(k.name, ()):
+            agg.add(k.index, k.value)
+    for appr in approach:
+        for agg in approach_aggs.get(appr.type, ()):
+            agg.add(appr.slice.start, appr.type)
+    attrs = dict((a.name, a.value) for a in flight_attrs if a.name in attr_names)
+
+    record = OrderedDict()
+    for column, source, key, how, _ in spec:
+        if source=='context':
+            record[column] = context.get(key)
+        elif source=='const':
+            record[column] = key
+        elif source=='attr':
+            record[column] = _attr_value(attrs, key, how)
+        else:
+            record[column] = aggregates[column].value()
+    return record
+
+
+def flight_record_columns(spec=FLIGHT_RECORD_SPEC):
+    '''[(column, column type)] for the table: the spec columns, then LATER_COLUMNS'''
+    return [(column, column_type) for column, _, _, _, column_type in spec] + LATER_COLUMNS
+
+
+def sql_type(column_type, dialect='oracle'):
+    '''column type for the dialect; spec types are Oracle types'''
+    if dialect=='sqlite':
+        return SQLITE_TYPES[column_type.split('(')[0]]
+    return column_type
+
+
+def flight_record_ddl(spec=FLIGHT_RECORD_SPEC, table='fds_flight_record', dialect='oracle'):
+    '''create table statement matching the records made by summarize_flight()'''
+    lines = []
+    for column, col_type in flight_record_columns(spec):
+        line = '    ' + column.ljust(24) + sql_type(col_type, dialect)
+        if column==PRIMARY_KEY:
+            line += ' primary key'
+        lines.append(line)
+    if_not_exists = 'if not exists ' if dialect=='sqlite' else ''
+    return 'create table ' + if_not_exists + table + ' (\n' + ',\n'.join(lines) + '\n)'
+
+
+def missing_columns_ddl(existing_columns, spec=FLIGHT_RECORD_SPEC, table='fds_flight_record', dialect='oracle'):
+    '''alter table statements adding spec columns that an existing table does not have yet'''
+    existing = set(c.lower() for c in existing_columns)
+    return ['alter table ' + table + ' add ' + column + ' ' + sql_type(col_type, dialect)
+            for column, col_type in flight_record_columns(spec) if column.lower() not in existing]
+
+
+if __name__=='__main__':
+    print flight_record_ddl() + ';'
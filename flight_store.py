@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+flight_store : single-file, versioned container for the results of one flight.
+
+Replaces the six pickle files per base flight (params, kti, kpv, phases, approach,
+fltattr) written by staged_helper.dump_pickles.
+
+File layout:
+    8 bytes    MAGIC
+    ...        data blocks, each starting on a 64 byte boundary
+    ...        index: pickled dict with format version, analyzer version, metadata and entries
+    16 bytes   index offset and index length, little-endian uint64
+
+Each value is pickled on its own, so readers load only the entries they ask for.
+Numpy arrays and masked arrays found anywhere inside a value (a parameter's .array,
+a masked array in params, ...) are taken out of the pickle and stored as raw typed
+buffers, which are read back through np.memmap.
+"""
+import os
+import struct
+import cPickle as pickle
+from cStringIO import StringIO
+from collections import OrderedDict, MutableMapping
+
+import numpy as np
+
+MAGIC = 'FDSRES01'
+FORMAT_VERSION = 1
+ALIGN = 64             # data blocks start on this boundary, so memory maps are aligned
+MIN_RAW_BYTES = 256    # smaller arrays stay inside the pickle
+_TRAILER = struct.Struct('<QQ')
+
+
+class StoreError(Exception):
+    pass
+
+
+def _raw_kind(obj):
+    '''how an object inside a value is stored: 'array', 'masked' or None (pickled)'''
+    kind = None
+    if type(obj) in (np.ndarray, np.memmap):
+        kind = 'array'
+    elif type(obj) is np.ma.MaskedArray:
+        kind = 'masked'
+    if kind and not obj.dtype.hasobject and obj.nbytes>=MIN_RAW_BYTES:
+        return kind
+    return None
+
+
+class _Writer(object):
+    def __init__(self, f):
+        self.f = f
+        self.pos = f.tell()
+
+    def block(self, data):
+        '''write bytes at the next aligned offset, return (offset, length)'''
+        pad = (-self.pos) % ALIGN
+        if pad:
+            self.f.write('\0'*pad)
+            self.pos += pad
+        offset = self.pos
+        self.f.write(data)
+        self.pos += len(data)
+        return offset, len(data)
+
+    def array(self, array):
+        array = np.ascontiguousarray(array)
+        offset, length = self.block(array.tostring())
+        return {'offset': offset, 'length': length, 'dtype': array.dtype.str, 'shape': array.shape}
+
+    def value(self, value):
+        '''write one value, return its index entry'''
+        arrays = []
+        def persistent_id(obj):
+            kind = _raw_kind(obj)
+            if kind=='array':
+                arrays.append({'kind': kind, 'data': self.array(obj)})
+            elif kind=='masked':
+                mask = np.ma.getmask(obj)
+                arrays.append({'kind': kind, 'data': self.array(np.ma.getdata(obj)),
+                               'mask': None if mask is np.ma.nomask else self.array(mask),
+                               'fill_value': obj.fill_value})
+            else:
+                return None
+            return len(arrays)-1
+        buf = StringIO()
+        pickler = pickle.Pickler(buf, pickle.HIGHEST_PROTOCOL)
+        pickler.persistent_id = persistent_id
+        pickler.dump(value)
+        return {'pickle': self.block(buf.getvalue()), 'arrays': arrays}
+
+
+def write_store(path, sections, analyzer_version, metadata=None):
+    '''write {section: {name: value}} to a new store at path.
+       The file is written under a temporary name and moved into place when complete.
+    '''
+    tmp_path = path + '.tmp'
+    entries = OrderedDict()
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        writer = _Writer(f)
+        for section, values in sections.items():
+            entries[section] = OrderedDict()
+            for name, value in values.items():
+                entries[section][name] = writer.value(value)
+        index = {'format_version': FORMAT_VERSION, 'analyzer_version': analyzer_version,
+                 'metadata': metadata or {}, 'entries': entries}
+        index_offset, index_length = writer.block(pickle.dumps(index, pickle.HIGHEST_PROTOCOL))
+        f.write(_TRAILER.pack(index_offset, index_length))
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(tmp_path, path)
+
+
+def _entry_nbytes(entry):
+    nbytes = entry['pickle'][1]
+    for spec in entry['arrays']:
+        nbytes += spec['data']['length']
+        if spec.get('mask'):
+            nbytes += spec['mask']['length']
+    return nbytes
+
+
+class FlightStore(object):
+    '''Reader for a file written by write_store().  Only the index is read on open.
+
+       mmap=True returns arrays backed by copy-on-write memory maps of the file:
+       nothing is read until the data is touched, and changes are never written back.
+    '''
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap = mmap
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC))!=MAGIC:
+                raise StoreError('not a flight store: '+path)
+            f.seek(-_TRAILER.size, os.SEEK_END)
+            index_offset, index_length = _TRAILER.unpack(f.read(_TRAILER.size))
+            f.seek(index_offset)
+            index = pickle.loads(f.read(index_length))
+        if index['format_version']>FORMAT_VERSION:
+            raise StoreError('flight store format '+str(index['format_version'])+' is newer than this reader: '+path)
+        self.analyzer_version = index['analyzer_version']
+        self.metadata = index['metadata']
+        self.entries = index['entries']
+
+    def sections(self):
+        return self.entries.keys()
+
+    def names(self, section):
+        return self.entries.get(section, {}).keys()
+
+    def nbytes(self, section, name=None):
+        '''bytes on disk for one entry, or for a whole section'''
+        if name is not None:
+            return _entry_nbytes(self.entries[section][name])
+        return sum(_entry_nbytes(e) for e in self.entries.get(section, {}).values())
+
+    def _block(self, f, block):
+        offset, length = block
+        f.seek(offset)
+        return f.read(length)
+
+    def _array(self, f, spec):
+        dtype = np.dtype(spec['dtype'])
+        shape = tuple(spec['shape'])
+        if self.mmap:
+            return np.memmap(self.path, dtype=dtype, mode='c', offset=spec['offset'], shape=shape)
+        return np.fromstring(self._block(f, (spec['offset'], spec['length'])), dtype=dtype).reshape(shape)
+
+    def _value(self, f, entry):
+        arrays = entry['arrays']
+        def persistent_load(pid):
+            spec = arrays[int(pid)]
+            data = self._array(f, spec['data'])
+            if spec['kind']=='array':
+                return data
+            mask = self._array(f, spec['mask']) if spec['mask'] else np.ma.nomask
+            return np.ma.MaskedArray(data, mask=mask, fill_value=spec['fill_value'], copy=False)
+        unpickler = pickle.Unpickler(StringIO(self._block(f, entry['pickle'])))
+        unpickler.persistent_load = persistent_load
+        return unpickler.load()
+
+    def load(self, section, name):
+        with open(self.path, 'rb') as f:
+            return self._value(f, self.entries[section][name])
+
+    def load_section(self, section):
+        '''all values of a section as an OrderedDict'''
+        with open(self.path, 'rb') as f:
+            return OrderedDict((name, self._value(f, entry)) for name, entry in self.entries.get(section, {}).items())
+
+    def lazy_section(self, section):
+        '''dict-like view of a section that reads each value on first access'''
+        return LazySection(self, section)
+
+
+class LazySection(MutableMapping):
+    '''Mapping over one section of a FlightStore.  Membership tests and keys() only use
+       the index; a value is read from the file the first time it is looked up.
+       Assignments and deletions are kept in memory and never written back, so it can
+       stand in for the params dict in derive_parameters_mitre.
+    '''
+    def __init__(self, store, section):
+        self.store = store
+        self.section = section
+        self.stored = store.names(section)
+        self._stored_set = set(self.stored)
+        self.values_in_memory = {}  # loaded or assigned values
+        self.deleted = set()
+        self.loaded_names = set()
+
+    def __contains__(self, name):
+        return name in self.values_in_memory or (name in self._stored_set and name not in self.deleted)
+
+    def __getitem__(self, name):
+        if name in self.values_in_memory:
+            return self.values_in_memory[name]
+        if name not in self._stored_set or name in self.deleted:
+            raise KeyError(name)
+        value = self.store.load(self.section, name)
+        self.values_in_memory[name] = value
+        self.loaded_names.add(name)
+        return value
+
+    def __setitem__(self, name, value):
+        self.values_in_memory[name] = value
+        self.deleted.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.values_in_memory.pop(name, None)
+        if name in self._stored_set:
+            self.deleted.add(name)
+
+    def __iter__(self):
+        for name in self.stored:
+            if name not in self.deleted:
+                yield name
+        for name in self.values_in_memory:
+            if name not in self._stored_set:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def bytes_total(self):
+        '''bytes on disk for the whole section'''
+        return self.store.nbytes(self.section)
+
+    def bytes_loaded(self):
+        return sum(self.store.nbytes(self.section, name) for name in self.loaded_names)
+
+    def stats(self):
+        '''how much of the section was actually read'''
+        total = self.bytes_total()
+        loaded = self.bytes_loaded()
+        return OrderedDict([('entries', len(self.stored)), ('loaded', len(self.loaded_names)),
+                            ('bytes_loaded', loaded), ('bytes_skipped', total-loaded)])
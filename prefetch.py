@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+prefetch : local scratch copies of flight files on the network shares.
+
+While one flight is analyzed, background threads copy the next ones from the central or
+serrano repository to a local directory (analyser_custom_settings.PREFETCH_PATH), so
+network transfer overlaps with compute and the analyzer reads only local disk:
+
+    cache = PrefetchCache(PREFETCH_PATH, max_bytes=20*2**30)
+    for flight_path_and_file, local_path in cache.iter_local(files_to_process, ahead=4):
+        ...read local_path...
+        cache.release(flight_path_and_file)
+    cache.close()
+
+Copies go to a temporary name and are renamed only when the byte count matches the source
+and the source size and mtime did not change during the copy; the copy keeps the source mtime.
+get() checks that the size and mtime of the copy still match the source, so copies left
+by an earlier run are reused, and a source rewritten since its copy is read directly.
+
+The cache holds at most max_bytes.  Files in use (between get() and release()) are pinned;
+the least recently used unpinned copies are deleted to make room.  A file that cannot be
+copied (too big, no room, copy error) is read from its original path instead.
+
+close() wakes any reader waiting in get() (which then returns the original path) and ends
+iter_local(), so a reader in another thread, e.g. a process pool's task feeder, cannot block
+a shutdown after an error.
+
+@author: keithc
+"""
+import os, time, hashlib, logging, threading, Queue
+from collections import OrderedDict
+
+import analyser_custom_settings
+
+PREFETCH_PATH = getattr(analyser_custom_settings, 'PREFETCH_PATH', None)
+PREFETCH_MAX_BYTES = getattr(analyser_custom_settings, 'PREFETCH_MAX_BYTES', 20*2**30)
+COPY_BUFFER = 4*2**20
+
+logger = logging.getLogger(__name__)
+
+
+def local_name(path):
+    '''cache file name for a source path: unique per path, still readable'''
+    return hashlib.sha1(os.path.abspath(path)).hexdigest()[:12] + '_' + os.path.basename(path)
+
+
+class _Entry(object):
+    __slots__ = ('source', 'local', 'state', 'size', 'pins', 'done')
+
+    def __init__(self, source, local, state='queued', size=0):
+        self.source = source    # None for copies adopted from an earlier run, until first asked for
+        self.local = local
+        self.state = state      # queued, copying, ready or failed
+        self.size = size
+        self.pins = 0
+        self.done = threading.Event()
+        if state=='ready': self.done.set()
+
+
+class PrefetchCache(object):
+    '''Copies flight files to cache_dir in threads background threads; see the module docstring.
+       get() blocks while max_pinned files are pinned, which bounds how far a reader can run ahead.
+    '''
+    def __init__(self, cache_dir=None, max_bytes=PREFETCH_MAX_BYTES, threads=2, max_pinned=8):
+        self.cache_dir = cache_dir or PREFETCH_PATH
+        if not self.cache_dir:
+            raise ValueError('no prefetch directory: set analyser_custom_settings.PREFETCH_PATH')
+        if not os.path.exists(self.cache_dir): os.makedirs(self.cache_dir)
+        self.max_bytes = max_bytes
+        self.max_pinned = max_pinned
+        self.lock = threading.Condition()
+        self.entries = OrderedDict()  # local name -> _Entry, least recently used first
+        self.used = 0                 # bytes of ready and copying entries
+        self.pinned = 0
+        self.closing = False
+        self.stats = OrderedDict([('hits', 0), ('copied', 0), ('bytes_copied', 0), ('bypassed', 0),
+                                  ('evicted', 0), ('copy_errors', 0), ('wait_seconds', 0.)])
+        self._adopt()
+        self.queue = Queue.Queue()
+        self.threads = [threading.Thread(target=self._copy_loop, name='prefetch-%d' % i) for i in range(threads)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def _adopt(self):
+        '''take over the copies of an earlier run, oldest first; remove its unfinished copies'''
+        found = []
+        for name in os.listdir(self.cache_dir):
+            local = os.path.join(self.cache_dir, name)
+            if name.endswith('.tmp'):
+                os.remove(local)
+            elif os.path.isfile(local):
+                st = os.stat(local)
+                found.append((st.st_ctime, name, local, st.st_size))
+        for _, name, local, size in sorted(found):
+            self.entries[name] = _Entry(None, local, 'ready', size)
+            self.used += size
+        self._make_room(0)  # max_bytes may be smaller than last time
+
+    ### reader side
+    def prefetch(self, paths):
+        '''queue background copies of paths, in order'''
+        with self.lock:
+            for path in paths:
+                self._queue(path)
+
+    def _queue(self, path):
+        name = local_name(path)
+        entry = self.entries.get(name)
+        if entry is None:
+            entry = self.entries[name] = _Entry(path, os.path.join(self.cache_dir, name))
+            self.queue.put(entry)
+        elif entry.state=='failed' and entry.pins==0:
+            entry.state = 'queued'
+            entry.done.clear()
+            self.queue.put(entry)
+        entry.source = path
+        self.entries[name] = self.entries.pop(name)  # most recently used
+        return entry
+
+    def get(self, path):
+        '''local path of a copy of path, waiting for its copy if needed; path itself if there is none.
+           Pins the copy until release(path).
+        '''
+        with self.lock:
+            while self.pinned >= self.max_pinned and not self.closing:
+                self.lock.wait()
+            if self.closing:
+                self.stats['bypassed'] += 1
+                return path
+            entry = self._queue(path)
+            entry.pins += 1
+            self.pinned += 1
+        start = time.time()
+        entry.done.wait()
+        with self.lock:
+            self.stats['wait_seconds'] += time.time()-start
+            if entry.state=='ready' and not self._matches_source(entry):
+                logger.warning('prefetch: stale copy of '+path+', reading the original')
+                self._discard(entry)
+                entry.state = 'failed'  # copied again when next asked for
+            if entry.state=='ready':
+                self.stats['hits'] += 1
+                return entry.local
+            self.stats['bypassed'] += 1
+            return path
+
+    def release(self, path):
+        '''unpin the copy of path; it may now be evicted'''
+        with self.lock:
+            entry = self.entries.get(local_name(path))
+            if entry is not None and entry.pins>0:
+                entry.pins -= 1
+                self.pinned -= 1
+                self.lock.notify_all()
+
+    def iter_local(self, paths, ahead=4):
+        '''(path, local path) for each of paths, keeping the next `ahead` files copying in the background.
+           Each local path is pinned; release(path) when done with it.
+        '''
+        paths = list(paths)
+        self.prefetch(paths[:ahead])
+        for i, path in enumerate(paths):
+            if i+ahead < len(paths):
+                self.prefetch([paths[i+ahead]])
+            local_path = self.get(path)
+            if self.closing:
+                return
+            yield path, local_path
+
+    def close(self):
+        '''stop the copy threads, skipping copies not yet started, and wake readers waiting in get().
+           Finished copies stay for the next run.  Safe to call more than once.
+        '''
+        with self.lock:
+            if self.closing:
+                return
+            self.closing = True
+            self.lock.notify_all()
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+    ### copy side
+    def _matches_source(self, entry):
+        try:
+            st_src, st_local = os.stat(entry.source), os.stat(entry.local)
+        except OSError:
+            return False
+        return st_src.st_size==st_local.st_size and int(st_src.st_mtime)==int(st_local.st_mtime)
+
+    def _discard(self, entry):
+        '''delete a ready copy.  Call with the lock held'''
+        try:
+            os.remove(entry.local)
+        except OSError:
+            pass
+        self.used -= entry.size
+
+    def _make_room(self, size):
+        '''evict least recently used unpinned copies until size more bytes fit.  Call with the lock held'''
+        for name, entry in self.entries.items():
+            if self.used + size <= self.max_bytes:
+                break
+            if entry.state=='ready' and entry.pins==0:
+                self._discard(entry)
+                del self.entries[name]
+                self.stats['evicted'] += 1
+        return self.used + size <= self.max_bytes
+
+    def _copy_loop(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+            reserved = 0
+            try:
+                src = os.stat(entry.source)
+                with self.lock:
+                    if entry.state!='queued' or self.closing:
+                        if self.closing: entry.state = 'failed'
+                        continue
+                    if not self._make_room(src.st_size):
+                        entry.state = 'failed'
+                        continue
+                    entry.state, entry.size = 'copying', src.st_size
+                    self.used += src.st_size
+                    reserved = src.st_size
+                self._copy(entry.source, entry.local, src)
+                with self.lock:
+                    entry.state = 'ready'
+                    self.stats['copied'] += 1
+                    self.stats['bytes_copied'] += src.st_size
+            except Exception, e:
+                logger.warning('prefetch: copy of '+str(entry.source)+' failed: '+str(e))
+                with self.lock:
+                    entry.state = 'failed'
+                    self.used -= reserved
+                    self.stats['copy_errors'] += 1
+            finally:
+                entry.done.set()
+
+    def _copy(self, source, local, src):
+        '''copy to a temporary name; rename only if complete and the source did not change meanwhile'''
+        tmp = local+'.tmp'
+        try:
+            copied = 0
+            with open(source, 'rb') as fin:
+                with open(tmp, 'wb') as fout:
+                    while True:
+                        block = fin.read(COPY_BUFFER)
+                        if not block:
+                            break
+                        fout.write(block)
+                        copied += len(block)
+            after = os.stat(source)
+            if copied!=src.st_size or after.st_size!=src.st_size or after.st_mtime!=src.st_mtime:
+                raise IOError('source changed or short read: %d of %d bytes' % (copied, src.st_size))
+            os.utime(tmp, (src.st_atime, src.st_mtime))
+            if os.path.exists(local): os.remove(local)  # Windows will not rename over it
+            os.rename(tmp, local)
+        except:
+            if os.path.exists(tmp): os.remove(tmp)
+            raise
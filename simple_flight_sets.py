@@ -13,7 +13,14 @@ import os
 import pandas as pd
 
 import analyser_custom_settings as settings 
-import fds_oracle  # db connection
+import flight_catalog  # indexed file lists, see analyser_custom_settings.FLIGHT_CATALOG_PATH
+import fds_db  # db connection: oracle or sqlite, see analyser_custom_settings.DB_BACKEND
+
+def _hdf5_files(input_dir, repo):
+    '''*.hdf5 in input_dir, from the flight catalog if FLIGHT_CATALOG_PATH is set'''
+    if getattr(settings, 'FLIGHT_CATALOG_PATH', None):
+        return flight_catalog.catalog_files(input_dir, '*.hdf5', repo)
+    return glob.glob(os.path.join(input_dir, '*.hdf5'))
 
 def _flight_list(files_to_process, aircraft_info, repo):
     flight_list=[]
@@ -33,9 +40,9 @@ def specimen_flight():
     '''FDS Specimen Flight, a partial 737-300 64wps frame'''
     input_dir  = settings.BASE_DATA_PATH + 'specimen_flight/'
     print input_dir
-    files_to_process = glob.glob(os.path.join(input_dir, '*.hdf5'))
-    print files_to_process
     repo='local'
+    files_to_process = _hdf5_files(input_dir, repo)
+    print files_to_process
     aircraft_info = {'Frame': 'B737-300_specimen', 'Manufacturer': 'Boeing', 'Precise Positioning': True, 'Series': 'B737-300', 'Family': 'B737', 'Frame Doubled': False}
     return _flight_list(files_to_process, aircraft_info, repo)
 
@@ -43,8 +50,8 @@ def tiny_test():
     '''quick test set'''
     input_dir  = settings.BASE_DATA_PATH + 'tiny_test/'
     print input_dir
-    files_to_process = glob.glob(os.path.join(input_dir, '*.hdf5'))
     repo='local'
+    files_to_process = _hdf5_files(input_dir, repo)
     aircraft_info={'Frame': 'A320_SFIM_ED45_CFM', 'Manufacturer': 'Airbus', 'Precise Positioning': True, 'Series': 'A320-200', 'Family': 'A320', 'Frame Doubled': False}
     return _flight_list(files_to_process, aircraft_info, repo)
 
@@ -53,8 +60,8 @@ def test10_shared():
     '''quick test set on serrano shared storage'''
     input_dir  = 'Y:/asias_fds/base_data/test10/'
     print input_dir
-    files_to_process = glob.glob(os.path.join(input_dir, '*.hdf5'))
     repo='serrano'
+    files_to_process = _hdf5_files(input_dir, repo)
     aircraft_info={'Frame': 'A320_SFIM_ED45_CFM', 'Manufacturer': 'Airbus', 'Precise Positioning': True, 'Series': 'A320-200', 'Family': 'A320', 'Frame Doubled': False}
     return _flight_list(files_to_process, aircraft_info, repo)
 
@@ -63,8 +70,8 @@ def test10():
     '''quick test set'''
     input_dir  = settings.BASE_DATA_PATH + 'test10/'
     print input_dir
-    files_to_process = glob.glob(os.path.join(input_dir, '*.hdf5'))
     repo='local'
+    files_to_process = _hdf5_files(input_dir, repo)
     aircraft_info={'Frame': 'A320_SFIM_ED45_CFM', 'Manufacturer': 'Airbus', 'Precise Positioning': True, 'Series': 'A320-200', 'Family': 'A320', 'Frame Doubled': False}
     return _flight_list(files_to_process, aircraft_info, repo)
 
@@ -78,7 +85,7 @@ def test_sql_jfk():
                     and orig_icao='KJFK' and dest_icao in ('KFLL','KMCO' )
                     --and rownum<15
                     """
-    files_to_process = fds_oracle.flight_record_filepaths(query)[:40]
+    files_to_process = fds_db.get_backend().flight_record_filepaths(query, max_rows=40)
     repo='central'
     aircraft_info={'Frame': 'A320_SFIM_ED45_CFM', 'Manufacturer': 'Airbus', 'Precise Positioning': True, 'Series': 'A320-200', 'Family': 'A320', 'Frame Doubled': False}
     return _flight_list(files_to_process, aircraft_info, repo)
@@ -93,7 +100,7 @@ def test_sql_jfk_local():
                     and orig_icao='KJFK' and dest_icao in ('KFLL','KMCO' )
                     --and rownum<15
                     """.replace('REPO',repo)
-    files_to_process = fds_oracle.flight_record_filepaths(query)[:40]
+    files_to_process = fds_db.get_backend().flight_record_filepaths(query, max_rows=40)
     aircraft_info={'Frame': 'A320_SFIM_ED45_CFM', 'Manufacturer': 'Airbus', 'Precise Positioning': True, 'Series': 'A320-200', 'Family': 'A320', 'Frame Doubled': False}
     return _flight_list(files_to_process, aircraft_info, repo)
 
@@ -106,6 +113,6 @@ def fll_local():
                     file_repository='REPO' 
                     and dest_icao in ('KFLL')
                     """.replace('REPO',repo)
-    files_to_process = fds_oracle.flight_record_filepaths(query) #[:40]
+    files_to_process = fds_db.get_backend().flight_record_filepaths(query) #[:40]
     aircraft_info={'Frame': 'A320_SFIM_ED45_CFM', 'Manufacturer': 'Airbus', 'Precise Positioning': True, 'Series': 'A320-200', 'Family': 'A320', 'Frame Doubled': False}
     return _flight_list(files_to_process, aircraft_info, repo)
@@ -5,10 +5,11 @@
     @author: KEITHC
 """
 import pdb
-import sys, traceback, os, glob, shutil, logging, time, copy
+import sys, traceback, os, glob, shutil, logging, time, hashlib, inspect, copy
+import threading, Queue
 import cPickle as pickle
 from datetime import datetime
-from collections import OrderedDict
+from collections import OrderedDict, MutableMapping
 import numpy as np
 from hdfaccess.file import hdf_file
 from analysis_engine import __version__ as analyzer_version # to check pickle files
@@ -26,15 +27,26 @@ import analysis_engine.node as node
 from analysis_engine.process_flight import get_derived_nodes, geo_locate, _timestamp
 import hdfaccess.file
 
-import fds_oracle
+import fds_db
+import fds_parquet
+import flight_catalog
+import flight_record_spec
+import flight_store
+from prefetch import PrefetchCache
 import fleets.frame_list as frame_list        # map of tail# to LFLs
 from fleets.frame_list import get_info_from_filename
 logger = logging.getLogger(__name__) #for process_short)_
 
 
-def get_input_files(INPUT_DIR, file_suffix, logger):
-    ''' returns a list of absolute paths '''
-    files_to_process = glob.glob(os.path.join(INPUT_DIR, file_suffix))
+def get_input_files(INPUT_DIR, file_suffix, logger, repository='local'):
+    ''' returns a list of absolute paths.  
+        With settings.FLIGHT_CATALOG_PATH set, the list comes from the flight catalog, 
+        which relists INPUT_DIR only if it has changed since the last run.
+    '''
+    if getattr(settings, 'FLIGHT_CATALOG_PATH', None):
+        files_to_process = flight_catalog.catalog_files(INPUT_DIR, file_suffix, repository)
+    else:
+        files_to_process = glob.glob(os.path.join(INPUT_DIR, file_suffix))
     file_count = len(files_to_process)
     logger.warning('Processing '+str(file_count)+' files.')
     return files_to_process, file_count
@@ -117,39 +129,41 @@ def aplot(array_dict={}, title='array plot', grid=True, legend=True):
     plt.close()
 
 
-def lplot(myhdf5, params=('Airspeed','Altitude STD')):
-    '''plot a list of parameters from an hdf5 file'''
+def lplot(myhdf5, params=('Airspeed','Altitude STD'), mapped=False):
+    '''plot a list of parameters from an hdf5 file.  mapped=True plots from memory mapped arrays (see read_param)'''
     pdict={}
     for p in params:
-        pdict[p]=myhdf5.get(p).array
+        pdict[p]=read_param(myhdf5, p, valid_only=False, mapped=mapped).array
     aplot(pdict)
 
 ### job report 
-JOB_REPORT_FIELDS = ['run_time', 'stage',  'profile', 'cmt', 'input_path', 'output_path', 'file_count', 'processing_seconds']
+JOB_REPORT_FIELDS = ['run_time', 'stage',  'profile', 'cmt', 'input_path', 'output_path', 'file_count', 'processing_seconds', 'skipped_count']
 
-def get_job_record(timestamp, stage, profile, comment, input_path, output_path, file_count, processing_seconds, file_repository='central'):
-    '''return job info as an OrderedDict'''
+def get_job_record(timestamp, stage, profile, comment, input_path, output_path, file_count, processing_seconds, file_repository='central',
+                   skipped_count=0):
+    '''return job info as an OrderedDict.  skipped_count: flights skipped as already current'''
     #computer_name = platform.node()
     rec = OrderedDict([ ('run_time', timestamp),    ('stage', stage), 
                         ('profile', profile),       ('cmt', comment), ('file_repository',file_repository),
                         ('input_path', input_path), ('output_path', output_path),
-                        ('file_count', file_count), ('processing_seconds', processing_seconds)
+                        ('file_count', file_count), ('processing_seconds', processing_seconds),
+                        ('skipped_count', skipped_count)
                      ])
     return rec
     
 
 def report_job(timestamp,   stage, profile, comment, input_path, output_path, 
-               file_count, processing_seconds, logger,  db_connection=None):
-    '''save timing record to csv and oracle (if available)'''
+               file_count, processing_seconds, logger,  db_connection=None, skipped_count=0):
+    '''save timing record to csv and oracle (if available).  skipped_count: flights skipped as already current'''
     report_name = settings.PREP_REPORTS_PATH + 'fds_jobs.csv'        
     job_rec = OrderedDict([ ('run_time', timestamp),    ('stage', stage), 
                             ('profile', profile),       ('cmt', comment), 
                             ('input_path', input_path), ('output_path', output_path),
-                            ('file_count', file_count), ('processing_seconds', processing_seconds)
+                            ('file_count', file_count), ('processing_seconds', processing_seconds),
+                            ('skipped_count', skipped_count)
                           ]) 
     #print job_rec                                          
-    with open(report_name,'a') as rpt:
-        rpt.write( ','.join([ str(v) for v in job_rec.values()]) + '\n') 
+    append_csv(report_name, [job_rec.values()], job_rec.keys())
     if db_connection:            
         dict_to_oracle(db_connection, job_rec, 'fds_jobs')
     logger.warning('\nJOB REPORT: \n' + '\n'.join([str(v) for v in job_rec.items()]) )
@@ -185,20 +199,148 @@ def report_timing(timestamp, stage, profile, filepath,
                        ('status',status),
                      ])
     #print timing_rec                                          
-    with open(report_name,'a') as rpt:
-        rpt.write( ','.join([ str(v) for v in timing_rec.values()]) + '\n') 
+    append_csv(report_name, [timing_rec.values()], timing_rec.keys())
     if db_connection:            
         dict_to_oracle(db_connection, timing_rec, 'fds_processing_time')
     logger.debug('align report ' + ','.join([str(v) for v in timing_rec.values()]) )
 
 
+### per-node timing
+NODE_TIMING_FIELDS = ['node_name', 'node_type', 'deps_seconds', 'derive_seconds', 'input_bytes', 'output_bytes', 'output_count']
+NODE_TIMING_INSERT = """insert /*append*/ into fds_node_timing (run_time, stage, profile, source_file, node_name, node_type, 
+                                             deps_seconds, derive_seconds, input_bytes, output_bytes, output_count) 
+                                    values (:run_time, :stage, :profile, :source_file, :node_name, :node_type, 
+                                            :deps_seconds, :derive_seconds, :input_bytes, :output_bytes, :output_count)"""
+
+def report_node_timing(timestamp, stage, profile, filepath, node_rows, logger, db_connection=None):
+    '''save one flight's NodeTimer rows to csv and oracle (if available)'''
+    if profile=='base':
+        report_name = settings.PREP_REPORTS_PATH + 'fds_node_timing.csv'        
+    else: 
+        report_name = settings.PROFILE_REPORTS_PATH + 'fds_node_timing.csv' 
+    filebase = os.path.basename(filepath)
+    records = [OrderedDict([('run_time', timestamp), ('stage', stage), ('profile', profile), ('source_file', filebase)] 
+                           + zip(NODE_TIMING_FIELDS, row)) 
+               for row in node_rows]
+    append_csv(report_name, [rec.values() for rec in records], ['run_time', 'stage', 'profile', 'source_file'] + NODE_TIMING_FIELDS)
+    if db_connection and records:
+        oracle_executemany(db_connection, NODE_TIMING_INSERT, [dict(rec) for rec in records])
+    logger.debug('node timing report '+filebase+' '+str(len(records))+' nodes')
+
+
+def hot_nodes(node_totals, top=20):
+    '''[(node name, calls, derive seconds, deps seconds)] of the nodes with the most total time'''
+    ranked = sorted(node_totals.items(), key=lambda (name, t): -(t[1]+t[2]))
+    return [(name, t[0], t[1], t[2]) for name, t in ranked[:top]]
+
+
 ### generic reporting
+class ReportWriter(object):
+    '''Buffered csv appender kept open for a whole run (see start_reports).
+    
+       Rows for any number of report files are held in memory and appended when
+       max_rows rows are waiting or max_seconds have passed since the last write,
+       and at close().  Each flush opens each file once, so reporting costs the same 
+       per run rather than per flight on network-mounted report directories.
+       A header is written only when a file is created.  Safe to use from the ReportSink thread.
+    '''
+    def __init__(self, max_rows=1000, max_seconds=30.):
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.pending = OrderedDict()  # path -> [header, lines]
+        self.row_count = 0
+        self.last_flush = time.time()
+        self.lock = threading.Lock()
+
+    def append(self, path, rows, header=None):
+        self.append_lines(path, [ ','.join([ str(v) for v in row]) + '\n' for row in rows], header)
+
+    def append_lines(self, path, lines, header=None):
+        with self.lock:
+            entry = self.pending.setdefault(path, [header, []])
+            entry[0] = entry[0] or header
+            entry[1].extend(lines)
+            self.row_count += len(lines)
+            if self.row_count>=self.max_rows or time.time()-self.last_flush>=self.max_seconds:
+                self._flush()
+
+    def _flush(self):
+        pending, self.pending = self.pending, OrderedDict()
+        self.row_count = 0
+        self.last_flush = time.time()
+        for path, (header, lines) in pending.items():
+            _write_csv_lines(path, lines, header)
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+
+
+def _retire_csv(path, header):
+    '''if path starts with a different header (e.g. a column was added since), rename it to
+       name_yyyymmddHHMMSS.csv so the new rows start a new file instead of misaligning with the old ones'''
+    if not os.path.isfile(path) or os.path.getsize(path)==0:
+        return
+    with open(path, 'rt') as f:
+        first_line = f.readline().rstrip('\r\n')
+    if first_line==','.join(header):
+        return
+    base, ext = os.path.splitext(path)
+    retired = base + '_' + datetime.fromtimestamp(os.path.getmtime(path)).strftime('%Y%m%d%H%M%S') + ext
+    while os.path.exists(retired):
+        retired = base + '_' + str(int(time.time()*1000)) + ext
+    os.rename(path, retired)
+    logger.warning('csv columns changed: '+path+' moved to '+retired)
+
+
+def _write_csv_lines(path, lines, header=None):
+    if header: _retire_csv(path, header)
+    new_file = not os.path.isfile(path) or os.path.getsize(path)==0
+    with open(path, 'at') as dest:
+        if header and new_file:
+            dest.write(','.join(header) + '\n')
+        dest.write(''.join(lines))
+
+
+_report_writer = None  # set by start_reports() for the duration of a run
+
+def start_reports(max_rows=1000, max_seconds=30.):
+    '''buffer csv reports in this process until stop_reports()'''
+    global _report_writer
+    stop_reports()
+    _report_writer = ReportWriter(max_rows, max_seconds)
+    return _report_writer
+
+
+def stop_reports():
+    '''write any buffered csv rows and go back to appending each report directly'''
+    global _report_writer
+    writer, _report_writer = _report_writer, None
+    if writer:
+        writer.close()
+
+
+def append_csv(path, rows, header=None):
+    '''append rows (lists of simple values) to a csv file, through the run's ReportWriter if one is active.
+       header is written only if the file is new; a file with a different header is renamed first (see _retire_csv).'''
+    append_csv_lines(path, [ ','.join([ str(v) for v in row]) + '\n' for row in rows], header)
+
+
+def append_csv_lines(path, lines, header=None):
+    '''append_csv() for rows already formatted as csv text lines'''
+    if _report_writer:
+        _report_writer.append_lines(path, lines, header)
+    else:
+        _write_csv_lines(path, lines, header)
+
+
 def record_to_csv(record, dest_path):
     '''append data from a list as a record to a CSV file.  assumes simple fields.'''
     #header = record.keys()
-    row =  [ str(v) for v in record]
-    with open(dest_path, 'at') as dest:
-         dest.write( ','.join(row) +'\n')
+    append_csv(dest_path, [record])
                
                
 def oracle_execute(connection, sql, values=None):
@@ -227,6 +369,53 @@ def dict_to_oracle(cn, mydict, table):
     oracle_execute(cn, isql, mydict.values())
         
 
+class ReportSink(object):
+    '''Runs reporting calls (csv appends, Oracle writes, kml) on a background writer thread
+       so the next flight can start deriving while the previous one is being reported.
+       
+       The queue is bounded: submit() blocks while it is full, so analysis slows down
+       to the pace of the database instead of piling up results in memory.
+       close() waits until everything queued has been written.
+    '''
+    def __init__(self, maxsize=4):
+        self.queue = Queue.Queue(maxsize)
+        self.error_count = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._drain, name='ReportSink')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, func, *args):
+        '''queue func(*args) for the writer thread'''
+        if self.closed:
+            raise RuntimeError('ReportSink is closed')
+        self.queue.put((func, args))
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:  # shutdown marker
+                    return
+                func, args = item
+                try:
+                    func(*args)
+                except:
+                    self.error_count += 1
+                    logger.warning('REPORT ERROR in '+func.__name__)
+                    traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    def close(self):
+        '''drain the queue and stop the writer thread'''
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+
+
 ### flight attribute reporting
 def dump_flight_attributes(flight):
     '''print out full list of flight attributes'''
@@ -239,84 +428,26 @@ def dump_flight_attributes(flight):
             print a.name+':', a.value
 
 
-def get_flight_record(source_file, output_path_and_file, registration, aircraft_info, flight, approach, kti, file_repository='central'):
-    '''build a record-per-flight summary from the base analysis    '''
-    flight_file = source_file
-    base_file = os.path.basename(output_path_and_file)
-    flt = OrderedDict([ ('file_repository',file_repository), ('source_file',flight_file), 
-                        ('file_path', output_path_and_file), ('base_file_path', base_file), 
-                        ('tail_number',registration), ('fleet_series', aircraft_info['Series']), ])    
-                        
-    attr = dict([(a.name, a.value) for a in flight])
-    flt['operator']= 'xxx'
-    flt['analyzer_version'] = attr.get('FDR Version','')
-    flt['flight_type'] = attr.get('FDR Flight Type','')     
-    flt['analysis_time'] = attr.get('FDR Analysis Datetime',None)
-    
-    lift = [k.index for k in kti if k.name=='Liftoff']
-    flt['liftoff_min']        = min(lift) if len(lift)>0 else None
-    tclimb = [k.index for k in kti if k.name=='Top of Climb']
-    flt['top_of_climb_min']   = min(tclimb) if len(tclimb)>0 else None
-    tdescent = [k.index for k in kti if k.name=='Top of Descent']
-    flt['top_of_descent_min'] = min(tdescent) if len(tdescent)>0 else None
-    tdown =[k.index for k in kti if k.name=='Touchdown']
-    flt['touchdown_min']      = min(tdown) if len(tdown)>0 else None   
-    flt['duration']       = attr.get('FDR Duration',None)
-
-    if attr.get('FDR Takeoff Airport',None): #key must exist and contain a val other than None
-        flt['orig_icao'] = attr['FDR Takeoff Airport']['code'].get('icao',None)
-        flt['orig_iata'] = attr['FDR Takeoff Airport']['code'].get('iata',None)
-        flt['orig_elevation'] = attr['FDR Takeoff Airport'].get('elevation',None)
-    else:
-        flt['orig_icao']=''; flt['orig_iata']=''; flt['orig_elevation']=None
+def get_flight_record(source_file, output_path_and_file, registration, aircraft_info, flight, approach, kti, file_repository='central', kpv=()):
+    '''build a record-per-flight summary from the base analysis, as described by flight_record_spec.FLIGHT_RECORD_SPEC'''
+    context = {'file_repository': file_repository, 'source_file': source_file, 
+               'file_path': output_path_and_file, 'base_file_path': os.path.basename(output_path_and_file),
+               'tail_number': registration, 'fleet_series': aircraft_info['Series']}
+    return flight_record_spec.summarize_flight(context, flight, kti, kpv, approach)  # an OrderedDict
 
-    if attr.get('FDR Takeoff Runway',None):
-        flt['orig_rwy'] = attr['FDR Takeoff Runway'].get('identifier',None)
-        flt['orig_rwy_length'] = attr['FDR Takeoff Runway']['strip'].get('length',None)
-    else:
-        flt['orig_rwy']=''; flt['orig_rwy_length']=None
-        
-    if attr.get('FDR Landing Airport',None):
-        flt['dest_icao'] = attr['FDR Landing Airport']['code'].get('icao',None)
-        flt['dest_iata'] = attr['FDR Landing Airport']['code'].get('iata',None)
-        flt['dest_elevation'] = attr['FDR Landing Airport'].get('elevation',None)
-    else:
-        flt['dest_icao']=''; flt['dest_iata']=''; flt['dest_elevation']=None
 
-    if attr.get('FDR Landing Runway',None):
-        flt['dest_rwy'] = attr['FDR Landing Runway'].get('identifier',None)
-        flt['dest_rwy_length'] = attr['FDR Landing Runway']['strip'].get('length',None)
-        if attr['FDR Landing Runway'].has_key('glideslope'):
-            flt['glideslope_angle'] = attr['FDR Landing Runway']['glideslope'].get('angle',None)
-        else:
-            flt['glideslope_angle']=None
-    else:
-        flt['dest_rwy']=''; flt['dest_rwy_length']=None; flt['glideslope_angle']=None
-
-    landing_count=0; go_around_count=0; touch_and_go_count=0
-    for appr in approach:
-        atype = appr.type
-        if atype=='LANDING':        landing_count+=1
-        elif atype=='GO_AROUND':    go_around_count+=1
-        elif atype=='TOUCH_AND_GO': touch_and_go_count+=1
-        else: pass
-    flt['landing_count']        = landing_count
-    flt['go_around_count']      = go_around_count
-    flt['touch_and_go_count']   = touch_and_go_count
-
-    flt['other_json'] = ''                  
-    #dump_flight_attributes(res['flight'])
-    return flt
-
-
-def save_flight_record(cn, flight_record, OUTPUT_DIR, output_path_and_file):
+def prepare_flight_record(flight_record, OUTPUT_DIR, output_path_and_file):
+     '''append the record to flight_record.csv and add the recorded parameter list for Oracle'''
      record_to_csv(flight_record.values(), OUTPUT_DIR+'flight_record.csv')
-     repo = flight_record['file_repository']
-     src = flight_record['source_file']
-     dsql= """delete from fds_flight_record where file_repository='REPO' and source_file='SRC'""".replace('REPO',repo).replace('SRC', src)
-     oracle_execute(cn, dsql)
      with hdfaccess.file.hdf_file(output_path_and_file) as hfile:
          flight_record['recorded_parameters'] = ','.join(hfile.lfl_keys())
+     return flight_record
+
+
+def save_flight_record(cn, flight_record, OUTPUT_DIR, output_path_and_file):
+     flight_record = prepare_flight_record(flight_record, OUTPUT_DIR, output_path_and_file)
+     dsql= """delete from fds_flight_record where file_repository=:file_repository and source_file=:source_file"""
+     oracle_execute(cn, dsql, {'file_repository':flight_record['file_repository'], 'source_file':flight_record['source_file']})
      dict_to_oracle(cn, flight_record, 'fds_flight_record')
      logger.debug(flight_record)
      
@@ -344,20 +475,32 @@ def csv_flight_measures(hdf_path, kti_list, kpv_list, phase_list, dest_path):
     #print 'csv flight measures', hdf_path, dest_path
     header = flight_measures_header()
     rows = flight_measures(hdf_path, kti_list, kpv_list, phase_list)     
-    with open(dest_path, 'at') as dest:
-        for row in rows:
-            vals = [ str(row.get(col,'')) for col in header]
-            dest.write( ','.join(vals) +'\n')
+    append_csv_lines(dest_path, rows.csv_lines(header), header)
     return rows
 
 
-def kti_to_oracle(cn, profile, flight_file, output_path_and_file, kti, file_repository='central'):
-    '''node: index name datetime latitude longitude'''
+KTI_INSERT = """insert /*append*/ into fds_kti (profile, source_file,  name,  time_index, base_file_path, file_repository) 
+                                    values (:profile, :source_file, :name, :time_index, :base_file_path, :file_repository)"""                
+KPV_INSERT = """insert /*append*/ into fds_kpv (profile, source_file,  name,  time_index,  value,  base_file_path,  units, file_repository) 
+                                    values (:profile, :source_file, :name, :time_index, :value, :base_file_path, :units, :file_repository)"""
+PHASE_INSERT = """insert /*append*/ into fds_phase (profile, source_file,  name,  time_index,  stop_edge, duration, base_file_path, file_repository) 
+                                    values (:profile, :source_file, :name,   :time_index, :stop_edge, :duration, :base_file_path, :file_repository)"""
+
+def measure_delete_sql(table):
+    '''bind-variable delete of one flight's rows from fds_kti, fds_kpv or fds_phase'''
+    return """delete from TABLE where file_repository=:file_repository and source_file=:source_file and profile=:profile""".replace('TABLE',table)
+
+
+def measure_base_file(profile, flight_file, output_path_and_file):
     if profile=='base':
-        base_file = os.path.basename(output_path_and_file)
+        return os.path.basename(output_path_and_file)
     else:
-        base_file = os.path.basename(flight_file)
-        
+        return os.path.basename(flight_file)
+
+
+def kti_rows(profile, flight_file, output_path_and_file, kti, file_repository='central'):
+    '''node: index name datetime latitude longitude'''
+    base_file = measure_base_file(profile, flight_file, output_path_and_file)
     rows = []    
     for value in kti:
         vals = [profile, flight_file, value.name, float(value.index), base_file, file_repository]
@@ -365,21 +508,12 @@ def kti_to_oracle(cn, profile, flight_file, output_path_and_file, kti, file_repo
             rows.append( vals )    
         else:
             print 'suspect kti index', value.name, value.index
-    dsql= """delete from fds_kti where file_repository='REPO' and source_file='SRC' and profile='PROFILE'""".replace('PROFILE',profile).replace('REPO',file_repository).replace('SRC', flight_file)
-    oracle_execute(cn, dsql)
-
-    isql = """insert /*append*/ into fds_kti (profile, source_file,  name,  time_index, base_file_path, file_repository) 
-                                    values (:profile, :source_file, :name, :time_index, :base_file_path, :file_repository)"""                
-    oracle_executemany(cn, isql, rows)
+    return rows
 
 
-def kpv_to_oracle(cn, profile, flight_file, output_path_and_file, params, kpv, file_repository='central'):
+def kpv_rows(profile, flight_file, output_path_and_file, params, kpv, file_repository='central'):
     '''node: index value name slice datetime latitude longitude'''
-    if profile=='base':
-        base_file = os.path.basename(output_path_and_file)
-    else:
-        base_file=os.path.basename(flight_file)
-    
+    base_file = measure_base_file(profile, flight_file, output_path_and_file)
     rows = []    
     for value in kpv:
         try:
@@ -388,37 +522,132 @@ def kpv_to_oracle(cn, profile, flight_file, output_path_and_file, params, kpv, f
             units = None
         vals = [profile, flight_file, value.name, float(value.index), float(value.value), base_file, units, file_repository ] 
         rows.append( vals )
-    dsql= """delete from fds_kpv where file_repository='REPO' and source_file='SRC' and profile='PROFILE'""".replace('PROFILE',profile).replace('REPO',file_repository).replace('SRC', flight_file)
-    oracle_execute(cn, dsql)
-    isql = """insert /*append*/ into fds_kpv (profile, source_file,  name,  time_index,  value,  base_file_path,  units, file_repository) 
-                                    values (:profile, :source_file, :name, :time_index, :value, :base_file_path, :units, :file_repository)"""
-    oracle_executemany(cn, isql, rows)
+    return rows
 
-    
-def phase_to_oracle(cn, profile, flight_file, output_path_and_file, phase_list, file_repository='central'):
+
+def phase_rows(profile, flight_file, output_path_and_file, phase_list, file_repository='central'):
     '''node: 'name slice start_edge stop_edge'''
-    if profile=='base':
-        base_file = os.path.basename(output_path_and_file)
-    else:
-        base_file=os.path.basename(flight_file)
+    base_file = measure_base_file(profile, flight_file, output_path_and_file)
     rows = []    
     for value in phase_list:
         vals = [profile, flight_file, value.name, float(value.start_edge), float(value.stop_edge), value.stop_edge-value.start_edge, base_file, file_repository ]                
         rows.append( vals )
-    dsql= """delete from fds_phase where file_repository='REPO' and source_file='SRC' and profile='PROFILE'""".replace('PROFILE',profile).replace('REPO',file_repository).replace('SRC', flight_file)
-    oracle_execute(cn, dsql)
-    isql = """insert /*append*/ into fds_phase (profile, source_file,  name,  time_index,  stop_edge, duration, base_file_path, file_repository) 
-                                    values (:profile, :source_file, :name,   :time_index, :stop_edge, :duration, :base_file_path, :file_repository)"""
-    oracle_executemany(cn, isql, rows)
+    return rows
+
+
+def kti_to_oracle(cn, profile, flight_file, output_path_and_file, kti, file_repository='central'):
+    rows = kti_rows(profile, flight_file, output_path_and_file, kti, file_repository)
+    oracle_execute(cn, measure_delete_sql('fds_kti'), {'profile':profile, 'source_file':flight_file, 'file_repository':file_repository})
+    oracle_executemany(cn, KTI_INSERT, rows)
+
+
+def kpv_to_oracle(cn, profile, flight_file, output_path_and_file, params, kpv, file_repository='central'):
+    rows = kpv_rows(profile, flight_file, output_path_and_file, params, kpv, file_repository)
+    oracle_execute(cn, measure_delete_sql('fds_kpv'), {'profile':profile, 'source_file':flight_file, 'file_repository':file_repository})
+    oracle_executemany(cn, KPV_INSERT, rows)
+
+    
+def phase_to_oracle(cn, profile, flight_file, output_path_and_file, phase_list, file_repository='central'):
+    rows = phase_rows(profile, flight_file, output_path_and_file, phase_list, file_repository)
+    oracle_execute(cn, measure_delete_sql('fds_phase'), {'profile':profile, 'source_file':flight_file, 'file_repository':file_repository})
+    oracle_executemany(cn, PHASE_INSERT, rows)
+
+
+class ResultWriter(object):
+    '''Buffers KTI/KPV/phase rows and flight records across many flights and writes them in batches.
+    
+       Per batch: one array delete per table (bind variables, one row per flight), one array 
+       insert per table and a single commit.  Use it as a context manager, or call close(),
+       so the last partial batch is written.
+       
+       A batch that fails to write is rolled back and stays queued: the error is raised, and the
+       next flush() tries the same flights again.  flush() returns the flight_paths given to 
+       add_rows() for the flights it committed, so callers can tell which flights are safely stored.
+    '''
+    def __init__(self, cn, batch_size=50):
+        self.cn = cn
+        self.batch_size = batch_size
+        self.pending = OrderedDict()  # (profile, source_file, file_repository) -> dict of rows
+        self.flights_written = 0
+        
+    def add_flight(self, profile, flight_file, output_path_and_file, kti, kpv, phases, params, 
+                   file_repository='central', flight_record=None, flight_paths=None):
+        '''queue one flight's results; a flight queued twice in a batch keeps only its latest results'''
+        rows = MeasuresTable(output_path_and_file, kti, kpv, phases).db_rows(profile, flight_file, output_path_and_file, params, file_repository)
+        return self.add_rows(profile, flight_file, rows, file_repository, flight_record, flight_paths)
+
+    def add_rows(self, profile, flight_file, rows, file_repository='central', flight_record=None, flight_paths=None):
+        '''queue one flight's rows from MeasuresTable.db_rows().  flight_paths (e.g. source and output path)
+           is handed back by the flush() that commits them.  returns what flush() returned if this flight 
+           completed a batch, else []'''
+        key = (profile, flight_file, file_repository)
+        self.pending.pop(key, None)
+        self.pending[key] = dict(rows, fds_flight_record=flight_record, flight_paths=flight_paths)
+        if len(self.pending)>=self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self):
+        '''write all queued flights with a single commit; returns their flight_paths (their keys where none was given)'''
+        if not self.pending:
+            return []
+        pending = self.pending
+        keys = [{'profile':p, 'source_file':f, 'file_repository':r} for (p, f, r) in pending.keys()]
+        cur = self.cn.cursor()
+        try:
+            for table, isql in (('fds_kti',KTI_INSERT), ('fds_kpv',KPV_INSERT), ('fds_phase',PHASE_INSERT)):
+                cur.executemany(measure_delete_sql(table), keys)
+                rows = [row for flt in pending.values() for row in flt[table]]
+                if rows:
+                    cur.executemany(isql, rows)
+            records = [flt['fds_flight_record'] for flt in pending.values() if flt['fds_flight_record']]
+            if records:
+                cur.executemany("""delete from fds_flight_record where file_repository=:file_repository and source_file=:source_file""",
+                                [{'file_repository':rec['file_repository'], 'source_file':rec['source_file']} for rec in records])
+                cols = records[0].keys()
+                isql = """insert /*append*/ into fds_flight_record (COLS) values (SYMS)""".replace('COLS',','.join(cols)).replace('SYMS',','.join([':'+k for k in cols]))
+                cur.executemany(isql, [[rec.get(k) for k in cols] for rec in records])
+            self.cn.commit()
+        except:
+            self.cn.rollback()
+            logger.warning('ResultWriter: failed to write a batch of '+str(len(pending))+' flights; they stay queued')
+            raise
+        finally:
+            cur.close()
+        self.pending = OrderedDict()
+        self.flights_written += len(pending)
+        logger.debug('ResultWriter: wrote '+str(len(pending))+' flights')
+        return [flt['flight_paths'] or key for key, flt in pending.items()]
+
+    def close(self):
+        return self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
 
              
 def pkl_suffix():
     '''file suffix versioning'''
     return 'ver'+analyzer_version.replace('.','_') +'.pkl'  # eg 0.0.5 => ver0_0_5.pkl
 
+def store_suffix():
+    '''file suffix versioning for flight_store result files'''
+    return 'ver'+analyzer_version.replace('.','_') +'.fdsres'  # eg 0.0.5 => ver0_0_5.fdsres
+
 def get_precomputed_parameters(flight_path_and_file, flight):    
-    ''' if pkl file exists and matches version, in read it into params dict'''
-    # suffix includes FDS version as a compatibility check
+    ''' if a result store (or older pkl file) exists and matches version, read it into params dict.
+        A result store is returned as a flight_store.LazySection.'''
+    # suffix includes FDS version as a compatibility check; the store also records the version inside
+    store_file = flight_path_and_file.replace('.hdf5', store_suffix())
+    if os.path.isfile(store_file):
+        store = flight_store.FlightStore(store_file)
+        if store.analyzer_version==analyzer_version:
+            logger.info('get_precomputed_profiles. found: '+ store_file)
+            return store.lazy_section('params')  # nodes are read only when a derive step asks for them
+        logger.warning('result store version '+str(store.analyzer_version)+' does not match analyzer '+analyzer_version+': '+store_file)
     source_file = flight_path_and_file.replace('.hdf5', pkl_suffix())
     precomputed_parameters={}
     if os.path.isfile(source_file):
@@ -430,34 +659,128 @@ def get_precomputed_parameters(flight_path_and_file, flight):
     return precomputed_parameters
 
 
-def flight_measures(hdf_path, kti_list, kpv_list, phase_list):
-    '''Adapted from FDS FlightDataAnalyzer/plot_flight.py csv_flight_details()
-        No HDF5 sourced values are included.'''
-    rows = []
+MEASURE_TYPES = np.array(['Key Time Instance', 'Key Point Value', 'Phase'], dtype=object)
+KTI_TYPE, KPV_TYPE, PHASE_TYPE = 0, 1, 2
+# keys of the old flight_measures() rows, besides path and type: the KTI and KPV recordtype fields,
+# and the Section namedtuple fields plus index and duration
+MEASURE_KEYS = {KTI_TYPE: ('index', 'name', 'datetime', 'latitude', 'longitude'),
+                KPV_TYPE: ('index', 'value', 'name', 'slice', 'datetime', 'latitude', 'longitude'),
+                PHASE_TYPE: ('name', 'slice', 'start_edge', 'stop_edge', 'index', 'duration')}
+
+
+def _float_column(values):
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+def _str_column(column):
+    '''csv text for a column; missing values (nan or None) are None, as str() wrote them'''
+    if column.dtype==np.float64:
+        return ['None' if v!=v else str(v) for v in column.tolist()]
+    return [str(v) for v in column.tolist()]
+
+
+class MeasuresTable(object):
+    '''One flight's KTIs, KPVs and phases as typed numpy columns, sorted by index.
     
-    for value in kti_list:
-        vals = value.todict()  # recordtype
-        vals['path'] = hdf_path
-        vals['type'] = 'Key Time Instance'
-        rows.append( vals )
+       Columns: type (KTI_TYPE, KPV_TYPE or PHASE_TYPE), index (a phase's start edge), 
+       duration and stop_edge (phases), value (KPVs), name, slice (KPVs and phases), datetime, latitude, longitude.
+       Missing numbers are nan, missing objects None.  The same columns feed the csv 
+       (csv_lines), Oracle/sqlite and Parquet rows (db_rows) without a dict per measure.
+       Iterating gives a dict per measure with the keys of the rows of the old list-of-dicts 
+       flight_measures() (MEASURE_KEYS), for compatibility.
+    '''
+    def __init__(self, hdf_path, kti_list, kpv_list, phase_list):
+        self.path = hdf_path
+        point_nodes = list(kti_list) + list(kpv_list)
+        phase_list = list(phase_list)
+        n_kti, n_kpv, n_phase = len(kti_list), len(kpv_list), len(phase_list)
+        start_edge = _float_column([p.start_edge for p in phase_list])
+        stop_edge = _float_column([p.stop_edge for p in phase_list])
+        no_points = np.empty(len(point_nodes)); no_points.fill(np.nan)
+        no_phases = np.empty(n_phase); no_phases.fill(np.nan)
+        columns = OrderedDict([
+            ('type',      np.repeat(np.array([KTI_TYPE, KPV_TYPE, PHASE_TYPE], dtype=np.int8), [n_kti, n_kpv, n_phase])),
+            ('index',     np.concatenate([_float_column([v.index for v in point_nodes]), start_edge])),
+            ('duration',  np.concatenate([no_points, stop_edge-start_edge])),
+            ('stop_edge', np.concatenate([no_points, stop_edge])),
+            ('value',     np.concatenate([_float_column([None]*n_kti + [v.value for v in kpv_list]), no_phases])),
+            ('name',      np.array([v.name for v in point_nodes] + [p.name for p in phase_list], dtype=object)),
+            ('slice',     np.array([getattr(v, 'slice', None) for v in point_nodes] + [p.slice for p in phase_list], dtype=object)),
+            ('datetime',  np.array([getattr(v, 'datetime', None) for v in point_nodes] + [None]*n_phase, dtype=object)),
+            ('latitude',  np.concatenate([_float_column([getattr(v, 'latitude', None) for v in point_nodes]), no_phases])),
+            ('longitude', np.concatenate([_float_column([getattr(v, 'longitude', None) for v in point_nodes]), no_phases])),
+            ])
+        order = np.argsort(columns['index'], kind='mergesort')  # stable, like the sorted() it replaces
+        self.columns = OrderedDict((name, column[order]) for name, column in columns.items())
+
+    def __len__(self):
+        return len(self.columns['index'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def _column(self, key):
+        return self.columns['index' if key=='start_edge' else key]
+
+    def __iter__(self):
+        '''dict per measure with the keys of the old flight_measures() rows (MEASURE_KEYS)'''
+        lists = dict((key, self._column(key).tolist()) for key in set(sum(MEASURE_KEYS.values(), ())))
+        for i, kind in enumerate(self.columns['type'].tolist()):
+            row = dict((k, None if lists[k][i]!=lists[k][i] else lists[k][i]) for k in MEASURE_KEYS[kind])  # nan -> None
+            row['path'] = self.path
+            row['type'] = MEASURE_TYPES[kind]
+            yield row
+
+    def csv_lines(self, header):
+        '''csv text lines for the given columns, as the old flight_measures() rows were written:
+           a column that a measure's row did not have is empty, a missing value is None'''
+        kinds = self.columns['type'].tolist()
+        text = {'path': [self.path]*len(self), 'type': MEASURE_TYPES[self.columns['type']].tolist()}
+        for name in header:
+            if name in text:
+                continue
+            has_key = dict((kind, name in keys) for kind, keys in MEASURE_KEYS.items())
+            if not any(has_key.values()):
+                text[name] = ['']*len(self)
+            else:
+                text[name] = [v if has_key[kind] else '' for v, kind in zip(_str_column(self._column(name)), kinds)]
+        return [ ','.join(vals) + '\n' for vals in zip(*[text[name] for name in header])]
+
+    def db_rows(self, profile, flight_file, output_path_and_file, params, file_repository='central'):
+        '''{table: rows} for KTI_INSERT, KPV_INSERT and PHASE_INSERT, as kti_rows, kpv_rows and phase_rows build them'''
+        base_file = measure_base_file(profile, flight_file, output_path_and_file)
+        kind, index, name = self.columns['type'], self.columns['index'], self.columns['name']
+        rows = {}
+        
+        is_kti = kind==KTI_TYPE
+        valid = is_kti & (index>0)
+        for suspect in np.flatnonzero(is_kti & ~valid):
+            print 'suspect kti index', name[suspect], index[suspect]
+        rows['fds_kti'] = [[profile, flight_file, n, i, base_file, file_repository]
+                           for n, i in zip(name[valid].tolist(), index[valid].tolist())]
+        
+        is_kpv = kind==KPV_TYPE
+        kpv_names = name[is_kpv].tolist()
+        units = {}
+        for n in set(kpv_names):
+            try:
+                units[n] = params.get(n).units
+            except:
+                units[n] = None
+        rows['fds_kpv'] = [[profile, flight_file, n, i, v, base_file, units[n], file_repository]
+                           for n, i, v in zip(kpv_names, index[is_kpv].tolist(), self.columns['value'][is_kpv].tolist())]
+        
+        is_phase = kind==PHASE_TYPE
+        rows['fds_phase'] = [[profile, flight_file, n, i, e, d, base_file, file_repository]
+                             for n, i, e, d in zip(name[is_phase].tolist(), index[is_phase].tolist(),
+                                                   self.columns['stop_edge'][is_phase].tolist(), self.columns['duration'][is_phase].tolist())]
+        return rows
 
-    for value in kpv_list:
-        vals = value.todict()  # recordtype
-        vals['path'] = hdf_path
-        vals['type'] = 'Key Point Value'
-        rows.append( vals )
 
-    for value in phase_list:
-        vals = value._asdict()  # namedtuple
-        vals['name'] = value.name
-        vals['path'] = hdf_path
-        vals['type'] = 'Phase'
-        vals['index'] = value.start_edge
-        vals['duration'] = value.stop_edge - value.start_edge  # (secs)
-        rows.append(vals)
-
-    rows = sorted(rows, key=lambda x: x['index'])
-    return rows
+def flight_measures(hdf_path, kti_list, kpv_list, phase_list):
+    '''Adapted from FDS FlightDataAnalyzer/plot_flight.py csv_flight_details()
+        No HDF5 sourced values are included.  Returns a MeasuresTable sorted by index.'''
+    return MeasuresTable(hdf_path, kti_list, kpv_list, phase_list)
     
 
 def make_kml_file(start_datetime, flight_attrs, kti, kpv, flight_file, REPORTS_DIR, output_path_and_file): 
@@ -475,6 +798,34 @@ def make_kml_file(start_datetime, flight_attrs, kti, kpv, flight_file, REPORTS_D
     
 
 ### run FlightDataAnalyzer for analyze and profile
+class NodeRegistry(dict):
+    '''Read-only {name: node class} mapping shared by every flight's NodeManager.
+       
+       Node classes are not changed during derivation, so flights share one registry 
+       instead of deep-copying it per flight.  Any attempt to add, replace or remove an 
+       entry raises TypeError.  Code that really needs a different set of nodes should 
+       take a private, mutable dict with copy().
+    '''
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('NodeRegistry is shared between flights and is read-only; use copy() for a private dict')
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def copy(self):
+        return dict(self)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        # dict subclasses are otherwise unpickled through __setitem__
+        return (NodeRegistry, (dict(self),))
+
+
 def prep_nodes(short_profile, module_names, include_flight_attributes):
     ''' go through modules to get derived nodes and check if we need to write a new hdf5 file'''
     if short_profile=='base':
@@ -499,11 +850,44 @@ def prep_nodes(short_profile, module_names, include_flight_attributes):
         write_hdf = False
         for (name, nd) in required_nodes.items():
             if str(nd.__bases__).find('DerivedParameterNode')>=0: write_hdf=True    
-    return required_params, derived_nodes, write_hdf
+    return required_params, NodeRegistry(derived_nodes), write_hdf
                
 
-def prep_order(frame_dict, test_file, start_datetime, derived_nodes, required_params):
-    ''' open example HDF to see recorded params and build process order'''
+def module_fingerprints(module_names):
+    '''[(module name, sha1 of its source file)] for imported node modules'''
+    fingerprints = []
+    for name in module_names:
+        module = sys.modules.get(name) or __import__(name, fromlist=['__name__'])
+        source_file = getattr(module, '__file__', '') or ''
+        if source_file.endswith('.pyc') or source_file.endswith('.pyo'):
+            source_file = source_file[:-1]
+        if os.path.isfile(source_file):
+            with open(source_file, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+        else:
+            digest = ''
+        fingerprints.append((name, digest))
+    return fingerprints
+
+
+def process_order_key(module_names, frame, series_keys, required_params):
+    '''cache key for a process order: analyzer version, node module sources, frame, recorded and requested parameters'''
+    key = hashlib.sha1()
+    key.update(analyzer_version)
+    for name, digest in module_fingerprints(sorted(set(settings.NODE_MODULES + module_names))):
+        key.update(name + digest)
+    key.update(str(frame))
+    key.update('\n'.join(sorted(series_keys)))
+    key.update('\n'.join(sorted(required_params)))
+    return key.hexdigest()
+
+
+def prep_order(frame_dict, test_file, start_datetime, derived_nodes, required_params, module_names=None):
+    ''' open example HDF to see recorded params and build process order
+    
+        If module_names is given and settings.PROCESS_ORDER_CACHE_PATH is set, the process order
+        is saved there and reused by later runs with the same key (see process_order_key).
+    '''
     _, _, _, registration = get_info_from_filename(os.path.basename(test_file), frame_dict)
     aircraft_info         = frame_dict[registration]
 
@@ -513,34 +897,248 @@ def prep_order(frame_dict, test_file, start_datetime, derived_nodes, required_pa
         series_keys = hdf.valid_param_names()[:]
         check_duration = hdf.duration
 
-    derived_nodes_copy = derived_nodes #copy.deepcopy(derived_nodes)
+    cache_dir = getattr(settings, 'PROCESS_ORDER_CACHE_PATH', None)
+    cache_file = None
+    if cache_dir and module_names is not None:
+        key = process_order_key(module_names, aircraft_info.get('Frame'), series_keys, required_params)
+        cache_file = os.path.join(cache_dir, 'process_order_'+key+'.pkl')
+        if os.path.isfile(cache_file):
+            with open(cache_file, 'rb') as f:
+                process_order = pickle.load(f)['process_order']
+            logger.warning( 'process order from cache: ' + cache_file )
+            return series_keys, process_order
+
     series_copy = series_keys[:]
     node_mgr = NodeManager( start_datetime, check_duration, 
                             series_copy,       #from HDF.   was hdf.valid_param_names(), #hdf_keys; should be from LFL
                             required_params,   #requested
-                            derived_nodes_copy,     #methods that can be computed; equals profile + base nodes   ????
+                            derived_nodes,     #methods that can be computed; equals profile + base nodes   ????
                             aircraft_info, 
                             achieved_flight_record={'Myfile':test_file,'Mydict':dict()}
                             )
     # calculate dependency tree
     process_order, gr_st = dependency_order(node_mgr, draw=False)     
     logger.warning( 'process order: ' + str(process_order[:5]) + '...' ) #, gr_st
+
+    if cache_file:
+        if not os.path.exists(cache_dir): os.makedirs(cache_dir)
+        with open(cache_file+'.tmp', 'wb') as f:
+            pickle.dump({'analyzer_version': analyzer_version, 'frame': aircraft_info.get('Frame'),
+                         'module_names': module_names, 'process_order': process_order}, f, pickle.HIGHEST_PROTOCOL)
+        file_move(cache_file+'.tmp', cache_file)  # other runs never see a partial file
     return series_keys, process_order
     
 
-def get_output_file(OUTPUT_DIR, flight_path_and_file, short_profile, write_hdf):
-    ''' if no new timeseries, just set output path  input path'''
+_read_only_links = []  # set once per process by read_only_external_links
+
+def read_only_external_links():
+    ''' make h5py open the targets of external links read-only, whatever the mode of the file holding
+        the link.  HDF5 otherwise uses that file's mode, and h5py has no call for it: this sets
+        H5Pset_elink_acc_flags on h5py's default link access list through ctypes.
+        Returns False if the hdf5 library h5py uses cannot be found.
+    '''
+    if _read_only_links:
+        return _read_only_links[0]
+    import ctypes, ctypes.util, h5py
+    from h5py._hl.base import dlapl  # the link access list h5py groups use to open their members
+    package_dir = os.path.dirname(h5py.__file__)
+    candidates = (glob.glob(os.path.join(package_dir, '.libs', 'libhdf5-*.so*'))    # linux wheels
+                  + glob.glob(os.path.join(package_dir, '.dylibs', 'libhdf5.*.dylib'))  # mac wheels
+                  + glob.glob(os.path.join(package_dir, 'hdf5.dll'))                 # windows wheels
+                  + [ctypes.util.find_library('hdf5') or 'hdf5'])                    # shared system library
+    hid_t = ctypes.c_int64 if h5py.version.hdf5_version_tuple >= (1, 10) else ctypes.c_int
+    ok = False
+    for path in candidates:
+        try:
+            set_flags = ctypes.CDLL(path).H5Pset_elink_acc_flags
+        except (OSError, AttributeError):
+            continue
+        set_flags.argtypes = [hid_t, ctypes.c_uint]
+        ok = set_flags(dlapl.id, h5py.h5f.ACC_RDONLY) >= 0
+        break
+    _read_only_links.append(ok)
+    return ok
+
+
+def make_sidecar_hdf(source_path, sidecar_path):
+    ''' create a small hdf5 file that holds no data of its own: file attributes are copied and every
+        series (and any other top level item) is an external link back to source_path.
+        New series written through hdf_file land in the sidecar only, so readers see the source 
+        series plus the new ones as one flight.
+        
+        Links use the absolute source path: the sidecar breaks if the source file is moved.
+        The source is only ever opened read-only, also through the links of a sidecar opened
+        read-write (see read_only_external_links), so it may be on a read-only share.  A write to
+        a linked series fails; derive_parameters_mitre refuses it up front (see linked_series).
+    '''
+    import h5py
+    source_path = os.path.abspath(source_path)
+    if not read_only_external_links():
+        raise IOError('sidecar hdf5: cannot make h5py open external links read-only; use hdf_output="copy"')
+    with h5py.File(source_path, 'r') as src:
+        with h5py.File(sidecar_path, 'w') as dest:
+            for k, v in src.attrs.items():
+                dest.attrs[k] = v
+            for top in src.keys():
+                if top=='series':
+                    series = dest.create_group('series')
+                    for name in src['series'].keys():
+                        series[name] = h5py.ExternalLink(source_path, '/series/'+name)
+                else:
+                    dest[top] = h5py.ExternalLink(source_path, '/'+top)
+            # the source is open read-only here, so following a link from this writable file
+            # fails unless links really open read-only
+            for top in src.keys():
+                try:
+                    dest[top]
+                except KeyError:
+                    raise IOError('sidecar hdf5: external links do not open read-only with this h5py; use hdf_output="copy"')
+                break
+    return sidecar_path
+
+
+def linked_series(hdf, name):
+    '''True if series name of an open hdf_file is an external link into another file (a sidecar):
+       the series belongs to the read-only source, so it cannot be rewritten through the sidecar'''
+    import h5py
+    return isinstance(hdf.hdf['series'].get(name, getlink=True), h5py.ExternalLink)
+
+
+def get_output_file(OUTPUT_DIR, flight_path_and_file, short_profile, write_hdf, hdf_output='copy', local_copy=None):
+    ''' if no new timeseries, just set output path  input path
+        hdf_output='copy' copies the whole source hdf5; 'sidecar' makes a linked file with only the new series
+        local_copy is a prefetched copy of the source to copy from; sidecars always link to the source itself
+    '''
     if write_hdf:
         logger.debug('writing new hdf5')
         flight_file          = os.path.basename(flight_path_and_file)
         output_path_and_file = (OUTPUT_DIR+flight_file).replace('.0','_0').replace('.hdf5', '_'+short_profile+'.hdf5')
-        shutil.copyfile(flight_path_and_file, output_path_and_file)  
+        if hdf_output=='sidecar':
+            make_sidecar_hdf(flight_path_and_file, output_path_and_file)
+        else:
+            shutil.copyfile(local_copy or flight_path_and_file, output_path_and_file)  
     else:
         logger.debug('read only. no new hdf5')
         output_path_and_file = flight_path_and_file            
     return output_path_and_file 
 
 
+### memory mapped parameter reads
+def _mappable(dataset):
+    '''contiguous, uncompressed and allocated datasets can be mapped straight from the file'''
+    return (dataset.chunks is None and dataset.compression is None 
+            and dataset.id.get_offset() is not None and dataset.size>0)
+
+
+def _map_dataset(dataset):
+    '''copy-on-write map of a dataset.  dataset.file is the file that holds the data: for a series 
+       reached through an ExternalLink (a sidecar, see make_sidecar_hdf) that is the source file'''
+    return np.memmap(dataset.file.filename, dtype=dataset.dtype, mode='c', offset=dataset.id.get_offset(), shape=dataset.shape)
+
+
+def read_param(hdf, name, valid_only=True, mapped=False, written=()):
+    ''' hdf.get_param(), optionally without copying the data.
+    
+        With mapped=True, a parameter whose data (and mask) datasets are contiguous and uncompressed
+        comes back with an array built on copy-on-write np.memmap views of the file: pages are read
+        on demand and shared between processes, and writes to the array never reach the file.
+        Everything except the array (frequency, offset, units, source_name, ...) comes from get_param
+        itself, reading only the first second of data.  Submasks are not loaded, as with get_param's default.
+        Anything else (compressed or chunked datasets, multistate parameters) is read by get_param.
+        
+        A mapped array aliases the file: pages not yet written to through the array show whatever
+        the file holds when they are read, so if the dataset is rewritten (set_param) while the array
+        is held, the array silently picks up the new bytes.  Names in written, the parameters the
+        caller may still write to this file (derive_parameters_mitre passes its derived nodes), are
+        therefore always read by get_param.
+    '''
+    if not mapped or name in written:
+        return hdf.get_param(name, valid_only=valid_only)
+    group = hdf.hdf['series'][name]
+    attrs = group.attrs
+    if valid_only and attrs.get('invalid'):
+        raise KeyError(name)  # as get_param does for invalid parameters
+    data = group.get('data')
+    mask = group.get('mask')
+    if ('values_mapping' in attrs or data is None or not _mappable(data) 
+            or (mask is not None and not _mappable(mask))):
+        return hdf.get_param(name, valid_only=valid_only)
+    try:
+        param = hdf.get_param(name, valid_only=valid_only, _slice=slice(0, 1), load_submasks=False)
+    except TypeError:  # an hdfaccess without partial reads: read it the usual way
+        return hdf.get_param(name, valid_only=valid_only)
+    param.array = np.ma.MaskedArray(_map_dataset(data), 
+                                    mask=_map_dataset(mask) if mask is not None else np.ma.nomask,
+                                    copy=False)
+    return param
+
+
+class LazySeries(MutableMapping):
+    '''Mapping of parameter name -> ParameterNode backed by an hdf5 file, used by Flight.
+       Names and units are known up front; a parameter's array is read on first access.
+       preload(names) reads many parameters with the file opened once.
+       Assignments and deletions are kept in memory only.
+    '''
+    def __init__(self, filepath, names, valid_only=True, units=None, mapped=False):
+        self.filepath = filepath
+        self.names = list(names)
+        self._names_set = set(self.names)
+        self.valid_only = valid_only
+        self.mapped = mapped
+        self.units = units or {}
+        self.loaded = {}
+        self.deleted = set()
+
+    def _load(self, ff, name):
+        param = node.derived_param_from_hdf(read_param(ff, name, self.valid_only, self.mapped))
+        if name in self.units:
+            param.units = self.units[name]
+        return param
+
+    def __contains__(self, name):
+        return name in self.loaded or (name in self._names_set and name not in self.deleted)
+
+    def __getitem__(self, name):
+        if name in self.loaded:
+            return self.loaded[name]
+        if name not in self._names_set or name in self.deleted:
+            raise KeyError(name)
+        with hdfaccess.file.hdf_file(self.filepath) as ff:
+            self.loaded[name] = self._load(ff, name)
+        return self.loaded[name]
+
+    def __setitem__(self, name, param):
+        self.loaded[name] = param
+        self.deleted.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self.loaded.pop(name, None)
+        if name in self._names_set:
+            self.deleted.add(name)
+
+    def __iter__(self):
+        for name in self.names:
+            if name not in self.deleted:
+                yield name
+        for name in self.loaded:
+            if name not in self._names_set:
+                yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def preload(self, names=None):
+        '''read the given parameters (default: all) that are not loaded yet, opening the file once'''
+        names = self.names if names is None else names
+        missing = [n for n in names if n in self._names_set and n not in self.loaded and n not in self.deleted]
+        if missing:
+            with hdfaccess.file.hdf_file(self.filepath) as ff:
+                for name in missing:
+                    self.loaded[name] = self._load(ff, name)
+
+
 class Flight(object):
     '''Container for data describing a single flight, principally from an hdf5 file
         used in conjunction with get_deps_series(), derive_parameters_series(), and derive()
@@ -552,14 +1150,18 @@ class Flight(object):
         self.duration = None
         self.start_datetime= None
         self.aircraft_info = {}            
-        self.series = {}         #dict of ParameterNode         
+        self.series = {}         #dict of ParameterNode; a LazySeries after load_from_hdf5         
         self.invalid_series = {} #dict of ParameterNode marked invalid
         self.lfl_params = []
         #maybe add params, kpv, phase etc. later
         
-    def load_from_hdf5(self, flight_dict):
+    def load_from_hdf5(self, flight_dict, mapped=False):
         '''load data from an hdf flight data file
             flight_series is a dictionary with fields:  'filepath', 'aircraft_info', 'repo'        
+            
+            Only parameter names and attributes are read here.  Arrays are read when a
+            series is first used, or in bulk with preload().  mapped=True uses memory 
+            mapped arrays where possible (see read_param).
         '''
         # look up aircraft info by tail number
         self.filepath = flight_dict['filepath']
@@ -568,21 +1170,26 @@ class Flight(object):
         flight_file   = os.path.basename(self.filepath)    
         print flight_file
         
+        valid_names, invalid_names, units = [], [], {}
         with hdfaccess.file.hdf_file(self.filepath) as ff:
             self.duration = ff.duration
             self.start_datetime = ff.start_datetime
-            # load valid hdf series into ParameterNode objects, invalid series into a separate dict
+            # one pass over the attributes only; valid series and invalid series go to separate mappings
             for s in ff.keys():
-                if ff[s].lfl==1:
+                attrs = ff.hdf['series'][s].attrs
+                if attrs.get('lfl')==1:
                     self.lfl_params.append(s)
-            for s in ff.keys():
-                if ff[s].invalid and ff[s].invalid==True:
-                    self.invalid_series[s] = node.derived_param_from_hdf(ff.get_param(s, valid_only=False))   
+                if attrs.get('invalid'):
+                    invalid_names.append(s)
                 else:
-                    #print s, ff.get(s).units
-                    param = node.derived_param_from_hdf(ff.get_param(s, valid_only=True))
-                    param.units = ff.get(s).units
-                    self.series[s] = param
+                    valid_names.append(s)
+                    units[s] = attrs.get('units')
+        self.series = LazySeries(self.filepath, valid_names, valid_only=True, units=units, mapped=mapped)
+        self.invalid_series = LazySeries(self.filepath, invalid_names, valid_only=False, mapped=mapped)
+
+    def preload(self, names=None):
+        '''read the arrays of the given series (default: all valid series) in one pass over the file'''
+        self.series.preload(names)
     
     def __repr__(self):
         s='class Flight'
@@ -607,7 +1214,7 @@ def get_deps_series(node_class, params, node_mgr, series):
                 deps.append(params[dep_name])
             elif node_mgr.get_attribute(dep_name) is not None:
                 deps.append(node_mgr.get_attribute(dep_name))
-            elif dep_name in series.keys():
+            elif dep_name in series:
                 deps.append(series[dep_name])
             else:  # dependency not available
                 #deps.append(None)
@@ -620,9 +1227,101 @@ def get_deps_series(node_class, params, node_mgr, series):
         return deps
 
 
-def get_deps(node_class, params, node_mgr, h5flight):
+def param_nbytes(param):
+    '''approximate memory held by a parameter's array and mask'''
+    array = getattr(param, 'array', None)
+    if array is None:
+        return 0
+    return np.ma.getdata(array).nbytes + np.ma.getmask(array).nbytes
+
+
+class NodeTimer(object):
+    '''Opt-in timing of the derive loops.  One row per derived node, in NODE_TIMING_FIELDS order:
+       dependency fetch and get_derived seconds, bytes of the dependency arrays, 
+       bytes of the result array and the number of items in a KPV/KTI/section result.'''
+    def __init__(self):
+        self.rows = []
+
+    def record(self, name, node, deps_seconds, derive_seconds, deps, result):
+        input_bytes = sum(param_nbytes(dep) for dep in deps if dep is not None)
+        output_count = len(result) if isinstance(result, list) else 0
+        self.rows.append((name, node.node_type.__name__, deps_seconds, derive_seconds, 
+                          input_bytes, param_nbytes(result), output_count))
+
+
+PARAM_CACHE_BYTES = 256*1024*1024  # default per-flight budget for ParameterCache
+
+def copy_param(param):
+    '''shallow copy of param with its own copy of the array (and mask), which the caller may change in place'''
+    array = getattr(param, 'array', None)
+    if not isinstance(array, np.ndarray):
+        return param
+    param = copy.copy(param)
+    param.array = array.copy()  # keeps the array subclass, e.g. MappedArray and its values_mapping
+    return param
+
+
+class ParameterCache(object):
+    '''Per-flight LRU cache of parameters read from the hdf5 file, consulted by get_deps().
+       Popular dependencies (e.g. Altitude AAL, Airspeed, Heading) are then read and
+       decompressed once per flight instead of once per dependent node.
+       
+       max_bytes bounds the arrays held; least recently used parameters are evicted first.
+       A parameter bigger than the whole budget is returned but not kept.
+       
+       Every consumer gets its own copy of the parameter and its array, as if read from the file:
+       nodes may change their inputs in place (e.g. repair_mask with copy=False) without changing
+       what the next node reads.  Copying an array is still far cheaper than reading and decompressing it.
+    '''
+    def __init__(self, max_bytes=PARAM_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # name -> (param, nbytes), oldest first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, name, loader):
+        '''return the cached parameter, or loader(name) on a miss.  Loader exceptions are not cached.'''
+        if name in self.items:
+            self.hits += 1
+            entry = self.items.pop(name)
+            self.items[name] = entry  # most recently used
+            return copy_param(entry[0])
+        self.misses += 1
+        param = loader(name)
+        size = param_nbytes(param)
+        if size <= self.max_bytes:
+            self.items[name] = (param, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, old_size) = self.items.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+        return copy_param(param)
+
+    def invalidate(self, name):
+        '''drop a parameter, e.g. after it was rewritten in the hdf5 file'''
+        if name in self.items:
+            _, size = self.items.pop(name)
+            self.bytes -= size
+
+    def clear(self):
+        self.items.clear()
+        self.bytes = 0
+
+    def stats(self):
+        '''counters for tuning the budget'''
+        return OrderedDict([('hits', self.hits), ('misses', self.misses), ('evictions', self.evictions),
+                            ('bytes', self.bytes), ('max_bytes', self.max_bytes)])
+
+
+def get_deps(node_class, params, node_mgr, h5flight, param_cache=None, mapped=False):
         # build ordered dependencies
         # 'params' is a dictionary of previously computed nodes
+        # 'param_cache' is an optional ParameterCache of parameters already read from h5flight
+        # 'mapped' reads uncompressed parameters as memory mapped arrays (see read_param); never
+        # the derived parameters, which this run may write to h5flight
         deps = []
         node_deps = node_class.get_dependency_names()
         #if DEBUG: print '  dependencies: ', node_deps
@@ -638,7 +1337,10 @@ def get_deps(node_class, params, node_mgr, h5flight):
                 # available on DerivedParameterNode
                 try:
                     #dp = series.get(dep_name)  ##########################################                    
-                    dp = derived_param_from_hdf(h5flight.get_param(dep_name, valid_only=True))
+                    if param_cache is None:
+                        dp = derived_param_from_hdf(read_param(h5flight, dep_name, True, mapped, node_mgr.derived_nodes))
+                    else:
+                        dp = param_cache.get(dep_name, lambda name: derived_param_from_hdf(read_param(h5flight, name, True, mapped, node_mgr.derived_nodes)))
                     #print 'derived hdf dep', dep_name
                 except KeyError:
                     # Parameter is invalid.
@@ -741,7 +1443,7 @@ def check_derived_array(param_name, result, duration ):
     return result
             
 
-def derive_parameters_series(flight, node_mgr, process_order, precomputed={}):
+def derive_parameters_series(flight, node_mgr, process_order, precomputed={}, node_timer=None):
     '''
     Non HDF5 version. Suitable for FFD and Notebook profile development.
     
@@ -755,6 +1457,8 @@ def derive_parameters_series(flight, node_mgr, process_order, precomputed={}):
     :type node_mgr: NodeManager
     :param process_order: Parameter / Node class names in the required order to be processed
     :type process_order: list of strings
+    :param node_timer: If given, records the time and data size of each node
+    :type node_timer: NodeTimer
     '''
     params    = OrderedDict(precomputed) #{}   # dictionary of derived params that aren't masked arrays
     res     = {'series':{}, 
@@ -783,12 +1487,16 @@ def derive_parameters_series(flight, node_mgr, process_order, precomputed={}):
         ####compute###########################################################    
         logger.debug('_derive_: computing '+param_name)        
         node_class = node_mgr.derived_nodes[param_name]  #NB raises KeyError if Node is "unknown"
+        deps_start = time.time()
         deps = get_deps_series(node_class, params, node_mgr, flight.series )  
         node = node_class()
         # Derive the resulting value
         if param_name =="Configuration":
             print deps
+        derive_start = time.time()
         result = node.get_derived(deps)
+        if node_timer is not None:
+            node_timer.record(param_name, node, derive_start-deps_start, time.time()-derive_start, deps, result)
         ###############################################################
 
         #post-process (node, result, params, res)
@@ -835,7 +1543,8 @@ def derive_parameters_series(flight, node_mgr, process_order, precomputed={}):
     return res, params
 
 
-def derive_parameters_mitre(hdf, node_mgr, process_order, precomputed_parameters={}):
+def derive_parameters_mitre(hdf, node_mgr, process_order, precomputed_parameters={}, param_cache=None, mapped_reads=False,
+                            stored_results=None, raw_results=None, node_timer=None):
     '''
     Derives the parameter values and if limits are available, applies
     parameter validation upon each param before storing the resulting masked
@@ -847,8 +1556,21 @@ def derive_parameters_mitre(hdf, node_mgr, process_order, precomputed_parameters
     :type node_mgr: NodeManager
     :param process_order: Parameter / Node class names in the required order to be processed
     :type process_order: list of strings
+    :param param_cache: Parameters read from hdf, shared by all nodes of this flight. A new one is made if None.
+    :type param_cache: ParameterCache
+    :param mapped_reads: Read uncompressed hdf parameters as memory mapped arrays instead of copies
+    :type mapped_reads: bool
+    :param stored_results: Raw node results from an earlier run that are still current (see load_node_results).
+        These are not derived again, but are aligned, validated and saved like a new result.
+    :type stored_results: dict-like
+    :param raw_results: If given, collects the raw result of every node derived or reused, for save_node_results.
+    :type raw_results: dict
+    :param node_timer: If given, records the time and data size of each derived node
+    :type node_timer: NodeTimer
     '''
     params    = precomputed_parameters   # dictionary of derived params that aren't masked arrays
+    if param_cache is None:
+        param_cache = ParameterCache()
 
     approach_list = ApproachNode(restrict_names=False)
     kpv_list = KeyPointValueNode(restrict_names=False) # duplicate storage, but maintaining types
@@ -864,21 +1586,31 @@ def derive_parameters_mitre(hdf, node_mgr, process_order, precomputed_parameters
         elif node_mgr.get_attribute(param_name) is not None:
             logger.debug('  derive_: get_attribute '+param_name)
             continue
-        elif param_name in params.keys():  # already calculated KPV/KTI/Phase ***********************NEW
+        elif param_name in params:  # already calculated KPV/KTI/Phase ***********************NEW
             logger.debug('  derive_parameters: re-using '+param_name)
             continue
 
-        logger.debug('  derive_: computing '+param_name)        
         node_class = node_mgr.derived_nodes[param_name]  #NB raises KeyError if Node is "unknown"        
-        deps = get_deps(node_class, params, node_mgr, hdf)
-        if deps is None: # e.g. if a required parameter is invalid
-            continue
-        # initialise node
-        node = node_class()
-        logger.info("Processing parameter %s", param_name)
-        # Derive the resulting value
-
-        result = node.get_derived(deps)
+        if stored_results is not None and param_name in stored_results:
+            logger.debug('  derive_: stored result '+param_name)
+            node = node_class()
+            result = stored_results[param_name]
+        else:
+            logger.debug('  derive_: computing '+param_name)        
+            deps_start = time.time()
+            deps = get_deps(node_class, params, node_mgr, hdf, param_cache, mapped_reads)
+            if deps is None: # e.g. if a required parameter is invalid
+                continue
+            # initialise node
+            node = node_class()
+            logger.info("Processing parameter %s", param_name)
+            # Derive the resulting value
+            derive_start = time.time()
+            result = node.get_derived(deps)
+            if node_timer is not None:
+                node_timer.record(param_name, node, derive_start-deps_start, time.time()-derive_start, deps, result)
+        if raw_results is not None:
+            raw_results[param_name] = result
 
         if node.node_type is KeyPointValueNode:
             #Q: track node instead of result here??
@@ -969,7 +1701,11 @@ def derive_parameters_mitre(hdf, node_mgr, process_order, precomputed_parameters
                                                        expected_length,
                                                        array_length))
             
+            if linked_series(hdf, param_name):
+                raise ValueError("'%s' is linked to the source file of this sidecar: "
+                                 "not writing it through the link" % param_name)
             hdf.set_param(result)
+            param_cache.invalidate(param_name)
             # Keep hdf_keys up to date.
             node_mgr.hdf_keys.append(param_name)
         elif issubclass(node.node_type, ApproachNode):
@@ -1017,19 +1753,444 @@ def dump_pickles(output_path_and_file, params, kti, kpv, phases, approach, fligh
     logger.info('saved '+ pickle_file)
 
 
+def dump_results(output_path_and_file, params, kti, kpv, phases, approach, flight_attrs, logger):
+    '''save base results to a single versioned flight_store file next to the output hdf5.
+       Replaces the six files written by dump_pickles.'''
+    store_file = output_path_and_file.replace('.hdf5', store_suffix())
+    results = OrderedDict([('kti', kti), ('kpv', kpv), ('phases', phases), ('approach', approach), ('fltattr', flight_attrs)])
+    flight_store.write_store(store_file, OrderedDict([('params', params), ('results', results)]), analyzer_version)
+    logger.info('saved '+ store_file)
+
+
+### node level incremental recompute
+def _code_names(code):
+    '''global names read by a code object and the functions nested in it'''
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _code_names(const)
+    return names
+
+
+def _used_names(obj):
+    '''global names used by a function, or by the methods and base classes of a class'''
+    if inspect.isfunction(obj):
+        return _code_names(obj.func_code)
+    names = set(base.__name__ for base in obj.__bases__)
+    for value in obj.__dict__.values():
+        for func in (value, getattr(value, '__func__', None), getattr(value, 'fget', None)):
+            if inspect.isfunction(func):
+                names |= _code_names(func.func_code)
+    return names
+
+
+def _class_source(obj, seen=None):
+    '''source of a node class (or a function of its module) followed by the module level names it uses:
+       the source of functions and classes defined in the same module, with what they use in turn,
+       and the repr of constants.  Imported names are left out: analyzer_version covers the library.
+       So editing one node does not change the fingerprints of the other nodes in its module.'''
+    module = sys.modules.get(obj.__module__)
+    seen = seen if seen is not None else set([obj.__name__])
+    try:
+        source = inspect.getsource(obj)
+    except (IOError, TypeError):
+        source = ''
+    if module is None:
+        return source
+    for name in sorted(_used_names(obj)):
+        if name in seen or name not in module.__dict__:  # seen: already in this fingerprint
+            continue
+        seen.add(name)
+        value = module.__dict__[name]
+        if inspect.isfunction(value) or inspect.isclass(value):
+            if value.__module__==module.__name__:
+                source += '\n' + name + ':' + _class_source(value, seen)
+        elif isinstance(value, (bool, int, long, float, basestring, tuple, list, dict, set, frozenset)):
+            source += '\n' + name + '=' + repr(value)
+    return source
+
+
+def node_fingerprints(derived_nodes, names):
+    '''{node name: sha1 of the analyzer version, the node class source (see _class_source) and its dependencies' fingerprints}
+       for the derived nodes in names.  A change to one node changes the fingerprint of everything downstream.
+    '''
+    fingerprints = {}
+    def fingerprint(name):
+        if name not in fingerprints:
+            node_class = derived_nodes.get(name)
+            if node_class is None:  # recorded parameter or attribute
+                return ''
+            fingerprints[name] = ''  # in case of a dependency cycle
+            key = hashlib.sha1(analyzer_version + name + _class_source(node_class))
+            for dep_name in node_class.get_dependency_names():
+                key.update(dep_name + fingerprint(dep_name))
+            fingerprints[name] = key.hexdigest()
+        return fingerprints[name]
+    return dict((name, fingerprint(name)) for name in names if name in derived_nodes)
+
+
+def node_store_file(output_dir, output_path_and_file):
+    '''node results file in output_dir, even when a read-only profile's output path is the source file'''
+    return os.path.join(output_dir, os.path.basename(output_path_and_file).replace('.hdf5', '_nodes_'+store_suffix()))
+
+
+def load_node_results(output_dir, output_path_and_file, source_fingerprint, fingerprints):
+    '''raw node results saved by an earlier run of this flight whose fingerprints still match, 
+       as a flight_store.LazySection, or None if there is no usable store.
+       Stored values are read (not mapped) so the store can be replaced at the end of the run.'''
+    store_file = node_store_file(output_dir, output_path_and_file)
+    if not os.path.isfile(store_file):
+        return None
+    store = flight_store.FlightStore(store_file, mmap=False)
+    if store.analyzer_version!=analyzer_version or store.metadata.get('source')!=source_fingerprint:
+        logger.info('node results out of date: '+store_file)
+        return None
+    stored_results = store.lazy_section('raw')
+    previous = store.metadata.get('fingerprints', {})
+    for name in list(stored_results):
+        if name not in fingerprints or previous.get(name)!=fingerprints[name]:
+            del stored_results[name]
+    return stored_results
+
+
+def save_node_results(output_dir, output_path_and_file, source_fingerprint, fingerprints, raw_results):
+    store_file = node_store_file(output_dir, output_path_and_file)
+    flight_store.write_store(store_file, {'raw': raw_results}, analyzer_version, 
+                             metadata={'source': source_fingerprint, 'fingerprints': fingerprints})
+    logger.info('saved '+ store_file)
+
+
+### skip flights that are already current
+def file_fingerprint(path, content_hash=False):
+    '''size and mtime of a file, or the sha1 of its contents'''
+    if content_hash:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), ''):
+                digest.update(chunk)
+        return 'sha1:'+digest.hexdigest()
+    st = os.stat(path)
+    return 'size:%d:mtime:%d' % (st.st_size, int(st.st_mtime))
+
+
+class RunManifest(object):
+    '''Flights already processed successfully by a profile, saved as a pickle in the output directory.
+    
+       A flight is current when its file fingerprint (size+mtime, or content hash) and the run key
+       (analyzer version, profile name, node module names and source hashes) are unchanged since 
+       it was recorded, and its output file still exists.
+    '''
+    def __init__(self, path, profile, module_names, content_hash=False):
+        self.path = path
+        self.content_hash = content_hash
+        key = hashlib.sha1(analyzer_version + profile)
+        for name, digest in module_fingerprints(sorted(set(settings.NODE_MODULES + module_names))):
+            key.update(name + digest)
+        self.run_key = key.hexdigest()
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                self.entries = pickle.load(f)
+        self.lock = threading.Lock()
+
+    def is_current(self, flight_path_and_file):
+        entry = self.entries.get(flight_path_and_file)
+        return bool(entry and entry['run_key']==self.run_key 
+                    and os.path.isfile(entry['output_path_and_file'])
+                    and entry['fingerprint']==file_fingerprint(flight_path_and_file, self.content_hash))
+
+    def record(self, flight_path_and_file, output_path_and_file):
+        entry = {'run_key': self.run_key, 'output_path_and_file': output_path_and_file,
+                 'fingerprint': file_fingerprint(flight_path_and_file, self.content_hash), 'recorded': datetime.now()}
+        with self.lock:
+            self.entries[flight_path_and_file] = entry
+
+    def save(self):
+        with self.lock:
+            with open(self.path+'.tmp', 'wb') as f:
+                pickle.dump(self.entries, f, pickle.HIGHEST_PROTOCOL)
+            file_move(self.path+'.tmp', self.path)
+
+
+def _record_committed(manifest, committed):
+    '''record flights as current once their results are committed: (source path, output path) pairs'''
+    for flight_path_and_file, output_path_and_file in committed:
+        manifest.record(flight_path_and_file, output_path_and_file)
+
+
 ###################################################################################################
+def _derive_flight(flight_path_and_file, ctx, logger, local_path=None):
+    '''run the analyzer on one flight.  returns a dict of results and status for reporting
+       local_path is a prefetched copy to read instead of flight_path_and_file (see prefetch.PrefetchCache);
+       results, reports and precomputed lookups still use flight_path_and_file.
+    '''
+    short_profile        = ctx['short_profile']
+    file_start_time      = time.time()
+    flight_file          = os.path.basename(flight_path_and_file)
+    logger.debug('starting '+ flight_file)
+    output_path_and_file  = get_output_file(ctx['output_dir'], flight_path_and_file, short_profile, ctx['write_hdf'], ctx['hdf_output'], local_path)
+    # read-only profiles read the source itself: the local copy if there is one
+    read_path = (local_path or flight_path_and_file) if output_path_and_file==flight_path_and_file else output_path_and_file
+
+    _, _, _, registration = get_info_from_filename(flight_file, ctx['frame_dict'])
+    aircraft_info         = ctx['frame_dict'][registration]
+    aircraft_info['Tail Number'] = registration
+    plan                  = ctx['plans'][aircraft_info['Frame']]
+    logger.debug(aircraft_info)
+    logger.warning(' *** Processing flight %s', flight_file)
+    res = {'flight_path_and_file': flight_path_and_file, 'flight_file': flight_file,
+           'output_path_and_file': output_path_and_file, 'frame': aircraft_info['Frame'],
+           'registration': registration, 'aircraft_info': aircraft_info, 'param_cache': None, 'precomputed': None,
+           'nodes': None, 'node_timing': None}
+    #if True:
+    try: 
+        series_copy = plan['series_keys'][:]
+        with hdf_file(read_path) as hdf:
+            node_mgr = NodeManager( ctx['start_datetime'], hdf.duration, 
+                                    series_copy,  #hdf.valid_param_names(),
+                                    ctx['required_params'], ctx['derived_nodes'], aircraft_info,  # shared read-only NodeRegistry
+                                    achieved_flight_record={'Myfile':output_path_and_file, 'Mydict':dict()}
+                                    )
+            precomputed_parameters={} if short_profile=='base' else get_precomputed_parameters(flight_path_and_file, node_mgr)
+            param_cache = ParameterCache(ctx['param_cache_bytes'])
+            stored_results, raw_results = None, None
+            if ctx['incremental']:
+                source_fingerprint = file_fingerprint(flight_path_and_file)
+                stored_results = load_node_results(ctx['output_dir'], output_path_and_file, source_fingerprint, plan['fingerprints'])
+                raw_results = OrderedDict()
+            node_timer = NodeTimer() if ctx['node_timing'] else None
+            kti, kpv, phases, approach, flight_attrs, params = derive_parameters_mitre(hdf, node_mgr, plan['process_order'], precomputed_parameters, param_cache, ctx['mapped_reads'],
+                                                                                       stored_results, raw_results, node_timer)                
+            if node_timer: res['node_timing'] = node_timer.rows
+            if ctx['incremental']:
+                reused = len(stored_results.loaded_names) if stored_results is not None else 0
+                res['nodes'] = OrderedDict([('reused', reused), ('computed', len(raw_results)-reused)])
+                logger.info('node results '+flight_file+' '+str(res['nodes'].items()))
+                save_node_results(ctx['output_dir'], output_path_and_file, source_fingerprint, plan['fingerprints'], raw_results)
+            res['param_cache'] = param_cache.stats()
+            logger.info('parameter cache '+flight_file+' '+str(res['param_cache'].items()))
+            param_cache.clear()
+            if isinstance(precomputed_parameters, flight_store.LazySection):
+                res['precomputed'] = precomputed_parameters.stats()
+                logger.info('precomputed parameters '+flight_file+' '+str(res['precomputed'].items()))
+ 
+        if short_profile=='base': dump_results(output_path_and_file, params, kti, kpv, phases, approach, flight_attrs, logger)
+        res.update({'kti':kti, 'kpv':kpv, 'phases':phases, 'approach':approach, 'flight_attrs':flight_attrs, 'params':params})
+        status='ok'
+    #'''
+    except:
+        ex_type, ex, tracebck = sys.exc_info()
+        logger.warning('ANALYZER ERROR '+flight_file)
+        traceback.print_tb(tracebck)
+        status='failed'
+        del tracebck                
+    #'''
+    res['status'] = status
+    res['processing_time'] = time.time()-file_start_time
+    logger.info(' *** Processing flight %s finished ' + flight_file + ' time: ' + str(res['processing_time']) + 'status: '+status)
+    return res
+
+
+def _save_flight_outputs(res, ctx, writer, logger):
+    '''queue KTI/KPV/phase results and the flight record for Oracle and Parquet, and write kml, for a successfully derived flight.
+       returns the (source path, output path) of the flights whose database rows are now committed:
+       this one at once without a database, else those of the batch this flight completed, if any.
+    '''
+    if res['status']!='ok':
+        return []
+    short_profile        = ctx['short_profile']
+    file_repository      = ctx['file_repository']
+    flight_file          = res['flight_file']
+    output_path_and_file = res['output_path_and_file']
+    exporter = ctx.get('exporter')
+    flight_record = None
+    if short_profile=='base' and (ctx['save_oracle'] or exporter):  # for base analyze, store flight record
+        flight_record = get_flight_record(flight_file, output_path_and_file, res['registration'], res['aircraft_info'], 
+                                          res['flight_attrs'], res['approach'], res['kti'], file_repository, res['kpv']) # an OrderedDict
+        flight_record = prepare_flight_record(flight_record, ctx['output_dir'], output_path_and_file)
+    if ctx['save_oracle'] or exporter:
+        # one set of measure columns feeds both the database and the Parquet export
+        rows = MeasuresTable(output_path_and_file, res['kti'], res['kpv'], res['phases']).db_rows(
+                                short_profile, flight_file, output_path_and_file, res['params'], file_repository)
+    flight_paths = (res['flight_path_and_file'], output_path_and_file)
+    committed = [flight_paths]
+    if ctx['save_oracle']:
+        committed = writer.add_rows(short_profile, flight_file, rows, file_repository, flight_record, flight_paths)
+        logger.debug('done ora out')
+    if exporter:
+        exporter.add_flight(short_profile, rows['fds_kti'], rows['fds_kpv'], rows['fds_phase'], flight_record)
+    if ctx['make_kml']:
+        make_kml_file(ctx['start_datetime'], res['flight_attrs'], res['kti'], res['kpv'], flight_file, ctx['reports_dir'], output_path_and_file)
+    return committed
+
+
+def _report_flight(res, ctx, writer, cn, timestamp, stage, logger, manifest=None):
+    '''save outputs then timing for one flight; output errors are reported in the flight's status.
+       Flights whose results are committed by this save are recorded current in manifest.'''
+    try:
+        committed = _save_flight_outputs(res, ctx, writer, logger)
+        if manifest: _record_committed(manifest, committed)
+    except:
+        logger.warning('OUTPUT ERROR '+res['flight_file'])
+        traceback.print_exc()
+        res['status'] = 'failed'
+    report_timing(timestamp, stage, ctx['short_profile'], res['flight_path_and_file'], res['processing_time'], res['status'], logger, cn)
+    if res['node_timing']:
+        report_node_timing(timestamp, stage, ctx['short_profile'], res['flight_path_and_file'], res['node_timing'], logger, cn)
 
-        
+
+def _add_cache_stats(totals, stats):
+    '''add the counters named in totals from one flight's stats dict'''
+    if stats:
+        for k in totals.keys():
+            totals[k] += stats[k]
+
+
+def group_files_by_frame(files_to_process, frame_dict):
+    '''OrderedDict of frame name -> files, frames in order of first appearance'''
+    groups = OrderedDict()
+    for flight_path_and_file in files_to_process:
+        _, _, _, registration = get_info_from_filename(os.path.basename(flight_path_and_file), frame_dict)
+        groups.setdefault(frame_dict[registration]['Frame'], []).append(flight_path_and_file)
+    return groups
+
+
+### process pool workers.  Each worker process keeps its own context and Oracle connection for the whole run.
+_worker_ctx = {}
+
+def _init_worker(ctx, flush_arrivals):
+    '''process pool initializer: keep the prebuilt process order and open a private database connection.
+       The last partial batch of results is written by _flush_worker, not by a finalizer.
+    '''
+    from multiprocessing.util import Finalize
+    _worker_ctx.clear()
+    _worker_ctx.update(ctx)
+    _worker_ctx['flush_arrivals'] = flush_arrivals
+    db = fds_db.get_backend(ctx['db_backend'])
+    _worker_ctx['cn'] = db.get_connection() if ctx['save_oracle'] else None
+    _worker_ctx['writer'] = ResultWriter(_worker_ctx['cn'], ctx['oracle_batch_size']) if ctx['save_oracle'] else None
+    if _worker_ctx['cn']:
+        # finalizers run when the pool is closed and joined; higher priority runs first
+        Finalize(None, db.release_connection, args=(_worker_ctx['cn'],), exitpriority=10)
+        Finalize(None, db.close_pool, exitpriority=5)
+    if ctx['parquet_dir']:
+        _worker_ctx['exporter'] = fds_parquet.MeasuresExport(ctx['start_run'], ctx['parquet_dir'])
+        Finalize(None, _worker_ctx['exporter'].close, exitpriority=20)
+    start_reports(ctx['report_flush_rows'], ctx['report_flush_seconds'])
+    Finalize(None, stop_reports, exitpriority=25)
+
+
+WORKER_RESULT_KEYS = ('flight_path_and_file', 'output_path_and_file', 'frame', 'processing_time', 'status', 
+                      'aircraft_info', 'param_cache', 'precomputed', 'nodes', 'node_timing', 'committed')
+
+def _run_worker(task):
+    '''process pool task: derive and save one flight, return what the parent needs for report_timing.
+       task is (flight path, local copy to read or None)
+    '''
+    flight_path_and_file, local_path = task
+    res = _derive_flight(flight_path_and_file, _worker_ctx, logger, local_path)
+    res['committed'] = []
+    try:
+        res['committed'] = _save_flight_outputs(res, _worker_ctx, _worker_ctx['writer'], logger)
+    except:
+        logger.warning('OUTPUT ERROR '+res['flight_file'])
+        traceback.print_exc()
+        res['status'] = 'failed'
+    return dict((k, res[k]) for k in WORKER_RESULT_KEYS)
+
+
+FLUSH_WAIT_SECONDS = 600.  # how long a _flush_worker task waits for the other workers to take theirs
+
+def _flush_worker(workers):
+    '''end-of-run pool task: write this worker's last partial batch of results and Parquet rows.
+       Run one per worker: each task waits until all workers have started theirs, so no worker takes two.
+       returns the flushed flights and the formatted error, if the write failed
+    '''
+    flushed = {'committed': [], 'error': None}
+    try:
+        if _worker_ctx['writer']: flushed['committed'] = _worker_ctx['writer'].flush()
+        if _worker_ctx.get('exporter'): _worker_ctx['exporter'].flush()
+    except:
+        flushed['error'] = traceback.format_exc()
+    arrivals = _worker_ctx['flush_arrivals']
+    with arrivals.get_lock():
+        arrivals.value += 1
+    deadline = time.time() + FLUSH_WAIT_SECONDS
+    while arrivals.value < workers and time.time() < deadline:
+        time.sleep(0.05)
+    if arrivals.value < workers:
+        logger.warning('_flush_worker: gave up waiting for the other workers; some may not have flushed')
+    return flushed
+    
         
 def run_analyzer(short_profile,    module_names,
                  logger,           files_to_process, 
                  input_dir,        output_dir,       reports_dir, 
                  include_flight_attributes=False, 
                  make_kml=False,   save_oracle=True, comment='',
-                 file_repository='central'):    
+                 file_repository='central', workers=1, oracle_batch_size=50,
+                 async_reports=False, report_queue_size=4,
+                 param_cache_bytes=PARAM_CACHE_BYTES, hdf_output='copy', mapped_reads=False,
+                 skip_current=False, content_hash=False, incremental=False,
+                 node_timing=False, node_timing_top=20, db_backend=None, parquet_dir=None,
+                 report_flush_rows=1000, report_flush_seconds=30., prefetch=0):    
     '''
     run FlightDataAnalyzer for analyze and profile. mostly file mgmt and reporting.
-    currently runs against a single fleet at a time.
+    
+    Files are grouped by frame (see group_files_by_frame) and one process order is built
+    per frame, from the first file of that frame, so mixed-fleet file lists run in one pass.
+    With more than one frame, report_job writes one row per frame group: its file count and
+    summed per-flight processing seconds, with the frame appended to the comment.
+    
+    workers > 1 spreads flights across a process pool.  Each worker borrows its own
+    Oracle connection and reuses the process order built here.  On Windows the
+    calling script must be protected by  if __name__=='__main__':
+    
+    Oracle results are buffered by a ResultWriter and committed every 
+    oracle_batch_size flights (per worker); the last batch is written at the end of the run,
+    by one _flush_worker task per worker.  A batch that fails to write stays queued and is tried 
+    again with the next batch; if the last write fails, run_analyzer raises.
+    db_backend='sqlite' saves them to a local file instead (see fds_db and fds_sqlite);
+    the default is settings.DB_BACKEND, else 'oracle'.
+    
+    parquet_dir (default settings.PARQUET_EXPORT_PATH, if set) also writes KTI/KPV/phase rows
+    and flight records as Parquet datasets partitioned by profile and run date (see fds_parquet).
+    
+    During the loop over files, csv reports are buffered by a ReportWriter (see start_reports)
+    and appended every report_flush_rows rows or report_flush_seconds seconds, and at the end.
+    
+    async_reports=True hands timing reports and Oracle/kml output to a ReportSink thread,
+    so derivation of the next flight overlaps with reporting of the last one.  At most 
+    report_queue_size flights wait for reporting before analysis pauses.
+    
+    param_cache_bytes is the per-flight budget of the ParameterCache used by get_deps();
+    the hit/miss totals are logged at the end of the run.
+    
+    When a profile derives new time series, hdf_output='copy' (default) writes them into a full 
+    copy of each source hdf5; hdf_output='sidecar' writes them to a small file that links back 
+    to the source series (see make_sidecar_hdf).
+    
+    mapped_reads=True reads uncompressed hdf parameters as shared memory maps rather than copies
+    (see read_param), which lowers peak memory per worker.
+    
+    skip_current=True skips flights whose source file, analyzer version and node modules are
+    unchanged since they were last processed successfully by this profile (see RunManifest).
+    Fingerprints use size+mtime, or a sha1 of the file with content_hash=True.
+    A flight is recorded only once the batch holding its database rows has been committed.
+    Skipped flights are counted in report_job.
+    
+    incremental=True saves the raw result of every derived node next to each flight's output,
+    with a fingerprint of the node class source and its dependencies (see node_fingerprints).
+    On the next run, nodes whose fingerprint is unchanged are reused from the store and
+    only changed nodes and their dependents are derived again.
+    
+    node_timing=True times the dependency fetch and get_derived call of every node (see NodeTimer),
+    writes the rows to fds_node_timing (csv and oracle), and logs the node_timing_top nodes 
+    with the most total time at the end of the run.
+    
+    prefetch=N copies the next N flights to settings.PREFETCH_PATH (at most settings.PREFETCH_MAX_BYTES)
+    in background threads while the current one is analyzed, and the analyzer reads the local copies
+    (see prefetch.PrefetchCache).  Use it for files on the central or serrano shares.
     '''        
     if not files_to_process or len(files_to_process)==0:
         print 'run_analyzer: No files to process.'
@@ -1041,73 +2202,172 @@ def run_analyzer(short_profile,    module_names,
     timestamp      = datetime.now()
     start_datetime = datetime(2012, 4, 1, 0, 0, 0)
     frame_dict     = frame_list.build_frame_list(logger)            
-    cn = fds_oracle.get_connection() if save_oracle else None
-    
-    # set up dependencies outside loop  
-    required_params, derived_nodes, write_hdf = prep_nodes(short_profile, module_names, include_flight_attributes)
-    test_file  = files_to_process[0]
-    logger.warning( 'test_file for prep_order(): '+ test_file)
-    series_keys, process_order = prep_order(frame_dict, test_file, start_datetime, derived_nodes, required_params)
+    db = fds_db.get_backend(db_backend)
+    cn = db.get_connection() if save_oracle else None
+    try:
+        # set up dependencies outside loop  
+        required_params, derived_nodes, write_hdf = prep_nodes(short_profile, module_names, include_flight_attributes)
+        groups = group_files_by_frame(files_to_process, frame_dict)
+        manifest = None
+        skipped = dict((frame, 0) for frame in groups.keys())
+        if skip_current:
+            manifest = RunManifest(output_dir+'_manifest_'+short_profile+'.pkl', short_profile, module_names, content_hash)
+            for frame, group_files in groups.items():
+                todo = [f for f in group_files if not manifest.is_current(f)]
+                skipped[frame] = len(group_files) - len(todo)
+                groups[frame] = todo
+            logger.warning('Skipping '+str(sum(skipped.values()))+' flights that are already current.')
+        plans = {}
+        for frame, group_files in groups.items():
+            if not group_files:
+                continue
+            test_file  = group_files[0]
+            logger.warning( 'test_file for prep_order(): '+ test_file + ' frame: '+str(frame)+' files: '+str(len(group_files)))
+            series_keys, process_order = prep_order(frame_dict, test_file, start_datetime, derived_nodes, required_params, module_names)
+            plans[frame] = {'series_keys': series_keys, 'process_order': process_order}
+            if incremental:
+                plans[frame]['fingerprints'] = node_fingerprints(derived_nodes, process_order)
+        files_to_process = [f for group_files in groups.values() for f in group_files]  # one frame at a time
+        ctx = {'short_profile': short_profile,     'output_dir': output_dir,   'reports_dir': reports_dir,
+               'write_hdf': write_hdf,             'frame_dict': frame_dict,   'start_datetime': start_datetime,
+               'required_params': required_params, 'derived_nodes': derived_nodes, 'plans': plans,
+               'make_kml': make_kml,               'save_oracle': save_oracle, 'file_repository': file_repository,
+               'oracle_batch_size': oracle_batch_size, 'param_cache_bytes': param_cache_bytes,
+               'hdf_output': hdf_output,           'mapped_reads': mapped_reads, 'incremental': incremental,
+               'node_timing': node_timing,         'db_backend': db_backend,
+               'parquet_dir': parquet_dir or getattr(settings, 'PARQUET_EXPORT_PATH', None), 'start_run': timestamp,
+               'report_flush_rows': report_flush_rows, 'report_flush_seconds': report_flush_seconds}
     
-    file_count = len(files_to_process)
-    logger.warning( 'Processing '+str(file_count)+' files.')
-    start_time = time.time()
-    ### loop over files        
-    for flight_path_and_file in files_to_process:
-        file_start_time = time.time()
-        flight_file          = os.path.basename(flight_path_and_file)
-        logger.debug('starting '+ flight_file)
-        output_path_and_file  = get_output_file(output_dir, flight_path_and_file, short_profile, write_hdf)
-
-        _, _, _, registration = get_info_from_filename(flight_file, frame_dict)
-        aircraft_info         = frame_dict[registration]
-        aircraft_info['Tail Number'] = registration
-        logger.debug(aircraft_info)
-        logger.warning(' *** Processing flight %s', flight_file)
-        #if True:
-        try: 
-            derived_nodes_copy = copy.deepcopy(derived_nodes)
-            series_copy = series_keys[:]
-            with hdf_file(output_path_and_file) as hdf:
-                node_mgr = NodeManager( start_datetime, hdf.duration, 
-                                        series_copy,  #hdf.valid_param_names(),
-                                        required_params, derived_nodes_copy, aircraft_info,
-                                        achieved_flight_record={'Myfile':output_path_and_file, 'Mydict':dict()}
-                                        )
-                precomputed_parameters={} if short_profile=='base' else get_precomputed_parameters(flight_path_and_file, node_mgr)
-                kti, kpv, phases, approach, flight_attrs, params = derive_parameters_mitre(hdf, node_mgr, process_order, precomputed_parameters)                
- 
-            if short_profile=='base': dump_pickles(output_path_and_file, params, kti, kpv, phases, approach, flight_attrs, logger)
-            status='ok'
-        #'''
-        except:
-            ex_type, ex, tracebck = sys.exc_info()
-            logger.warning('ANALYZER ERROR '+flight_file)
-            traceback.print_tb(tracebck)
-            status='failed'
-            del tracebck                
-        #'''
-        logger.info(' *** Processing flight %s finished ' + flight_file + ' time: ' + str(time.time()-file_start_time) + 'status: '+status)
-        # reports
+        file_count = len(files_to_process)
+        logger.warning( 'Processing '+str(file_count)+' files.')
+        start_time = time.time()
         stage = 'analyze' if short_profile=='base' else 'profile'    
-        processing_time = time.time()-file_start_time
-        report_timing(timestamp, stage, short_profile, flight_path_and_file, processing_time, status, logger, cn)
-
-        if save_oracle and status=='ok':
-            kti_to_oracle(cn, short_profile, flight_file, output_path_and_file, kti, file_repository)
-            phase_to_oracle(cn, short_profile, flight_file, output_path_and_file, phases, file_repository)
-            kpv_to_oracle(cn, short_profile, flight_file, output_path_and_file, params, kpv, file_repository)
-            if short_profile=='base':  # for base analyze, store flight record
-                 flight_record = get_flight_record(flight_file, output_path_and_file, registration, aircraft_info, flight_attrs, approach, kti, file_repository) # an OrderedDict
-                 save_flight_record(cn, flight_record, output_dir, output_path_and_file)                     
-            logger.debug('done ora out')
-        if status=='ok' and make_kml:
-            make_kml_file(start_datetime, flight_attrs, kti, kpv, flight_file, reports_dir, output_path_and_file)
-
-    ### end loop
-    report_job(timestamp, stage, short_profile, comment, input_dir, output_dir, 
-               len(files_to_process), (time.time()-start_time), logger, db_connection=cn)
-    if save_oracle:  cn.close()
+        aircraft_info = None
+        sink = ReportSink(report_queue_size) if async_reports else None
+        cache_totals = OrderedDict([('hits', 0), ('misses', 0), ('evictions', 0)])
+        group_totals = OrderedDict([(frame, OrderedDict([('file_count', 0), ('ok', 0), ('failed', 0), ('processing_seconds', 0.), 
+                                                         ('skipped', skipped[frame])])) 
+                                    for frame in groups.keys()])
+        precomputed_totals = OrderedDict([('bytes_loaded', 0), ('bytes_skipped', 0)])
+        node_totals = OrderedDict([('reused', 0), ('computed', 0)])
+        node_seconds = {}  # node name -> [calls, derive seconds, deps seconds]
+        def tally(res):
+            _add_cache_stats(cache_totals, res['param_cache'])
+            _add_cache_stats(precomputed_totals, res['precomputed'])
+            _add_cache_stats(node_totals, res['nodes'])
+            for row in res['node_timing'] or []:
+                t = node_seconds.setdefault(row[0], [0, 0., 0.])
+                t[0] += 1
+                t[1] += row[3]
+                t[2] += row[2]
+            totals = group_totals[res['frame']]
+            totals['file_count'] += 1
+            totals['ok' if res['status']=='ok' else 'failed'] += 1
+            totals['processing_seconds'] += res['processing_time']
+        
+        ### loop over files        
+        start_reports(report_flush_rows, report_flush_seconds)
+        prefetcher = None
+        tasks = ((f, None) for f in files_to_process)  # (flight, local copy to read)
+        if prefetch and write_hdf and hdf_output=='sidecar':
+            logger.warning('prefetch ignored: sidecar outputs read the series from the source files')
+        elif prefetch:
+            prefetcher = PrefetchCache(max_pinned=prefetch+workers)
+            tasks = prefetcher.iter_local(files_to_process, prefetch)
+        if workers>1:
+            import multiprocessing
+            logger.warning('Using a pool of '+str(workers)+' worker processes.')
+            pool = multiprocessing.Pool(processes=workers, initializer=_init_worker, 
+                                        initargs=(ctx, multiprocessing.Value('i', 0)))
+            try:
+                for res in pool.imap_unordered(_run_worker, tasks):
+                    if prefetcher: prefetcher.release(res['flight_path_and_file'])
+                    aircraft_info = res['aircraft_info']
+                    tally(res)
+                    if manifest: _record_committed(manifest, res['committed'])
+                    if sink:
+                        sink.submit(report_timing, timestamp, stage, short_profile, res['flight_path_and_file'], res['processing_time'], res['status'], logger, cn)
+                    else:
+                        report_timing(timestamp, stage, short_profile, res['flight_path_and_file'], res['processing_time'], res['status'], logger, cn)
+                    if res['node_timing']:
+                        if sink:
+                            sink.submit(report_node_timing, timestamp, stage, short_profile, res['flight_path_and_file'], res['node_timing'], logger, cn)
+                        else:
+                            report_node_timing(timestamp, stage, short_profile, res['flight_path_and_file'], res['node_timing'], logger, cn)
+                # each worker writes its last partial batch; a failed write fails the run rather than losing rows quietly
+                flush_errors = []
+                for flushed in pool.imap_unordered(_flush_worker, [workers]*workers):
+                    if manifest: _record_committed(manifest, flushed['committed'])
+                    if flushed['error']: flush_errors.append(flushed['error'])
+                pool.close()
+                if flush_errors:
+                    raise RuntimeError('workers failed to write their last batch of results:\n'+'\n'.join(flush_errors))
+            except:
+                if prefetcher: prefetcher.close()  # wakes the pool's task feeder if it waits in get(), or terminate() hangs
+                pool.terminate()
+                raise
+            finally:
+                if prefetcher: prefetcher.close()
+                pool.join()
+                if sink: sink.close()
+                stop_reports()
+        else:
+            writer = ResultWriter(cn, oracle_batch_size) if save_oracle else None
+            if ctx['parquet_dir']: ctx['exporter'] = fds_parquet.MeasuresExport(timestamp, ctx['parquet_dir'])
+            def report(res):
+                '''save and report one flight, then count it: a failed save turns its status to failed'''
+                try:
+                    _report_flight(res, ctx, writer, cn, timestamp, stage, logger, manifest)
+                finally:
+                    tally(res)
+            try:
+                for flight_path_and_file, local_path in tasks:
+                    res = _derive_flight(flight_path_and_file, ctx, logger, local_path)
+                    if prefetcher: prefetcher.release(flight_path_and_file)
+                    aircraft_info = res['aircraft_info']
+                    # outputs, reports and totals, in the background thread with a sink (totals are read after sink.close())
+                    if sink:
+                        sink.submit(report, res)
+                    else:
+                        report(res)
+            finally:
+                if sink: sink.close()  # the writer thread must finish before the writer is flushed
+                if writer:
+                    committed = writer.close()
+                    if manifest: _record_committed(manifest, committed)
+                if ctx.get('exporter'): ctx['exporter'].close()
+                if prefetcher: prefetcher.close()
+                stop_reports()
+        if sink and sink.error_count:
+            logger.warning(str(sink.error_count)+' background reporting calls failed; see log for tracebacks')
+
+        logger.warning('parameter cache totals: '+str(cache_totals.items()))
+        if prefetcher:
+            logger.warning('prefetch: '+str(prefetcher.stats.items()))
+        if precomputed_totals['bytes_loaded'] or precomputed_totals['bytes_skipped']:
+            logger.warning('precomputed base results: '+str(precomputed_totals.items()))
+        if incremental:
+            logger.warning('node results: '+str(node_totals.items()))
+        if node_timing:
+            logger.warning('hot nodes (name, calls, derive seconds, dependency seconds):')
+            for name, calls, derive_seconds, deps_seconds in hot_nodes(node_seconds, node_timing_top):
+                logger.warning('  %-60s %6d %10.3f %10.3f', name, calls, derive_seconds, deps_seconds)
+
+        if manifest: manifest.save()
+
+        ### end loop
+        if len(group_totals)==1:
+            report_job(timestamp, stage, short_profile, comment, input_dir, output_dir, 
+                       len(files_to_process), (time.time()-start_time), logger, db_connection=cn,
+                       skipped_count=sum(skipped.values()))
+        else:
+            for frame, totals in group_totals.items():
+                logger.warning('frame group '+str(frame)+': '+str(totals.items()))
+                report_job(timestamp, stage, short_profile, (comment+' frame='+str(frame)).strip(), input_dir, output_dir, 
+                           totals['file_count'], totals['processing_seconds'], logger, db_connection=cn,
+                           skipped_count=totals['skipped'])
+    finally:
+        if save_oracle:  db.release_connection(cn)
     for handler in logger.handlers: handler.close()        
     return aircraft_info
     
@@ -1115,7 +2375,8 @@ def run_analyzer(short_profile,    module_names,
 def run_profile(profile_name, module_names, 
                 LOG_LEVEL, FILES_TO_PROCESS, 
                 COMMENT, MAKE_KML_FILES, 
-                FILE_REPOSITORY='central', save_oracle=True ):
+                FILE_REPOSITORY='central', save_oracle=True, workers=1, hdf_output='copy',
+                skip_current=False, incremental=False, node_timing=False, db_backend=None, parquet_dir=None, prefetch=0 ):
     reports_dir = settings.PROFILE_REPORTS_PATH
     logger = initialize_logger(LOG_LEVEL)
     # Determine module names so FlightDataAnalyzer knows what nodes it is working with. Must be in PYTHON_PATH.
@@ -1131,7 +2392,15 @@ def run_profile(profile_name, module_names,
              make_kml=MAKE_KML_FILES, 
              save_oracle=save_oracle,
              comment=COMMENT,
-             file_repository=FILE_REPOSITORY)   
+             file_repository=FILE_REPOSITORY,
+             workers=workers,
+             hdf_output=hdf_output,
+             skip_current=skip_current,
+             incremental=incremental,
+             node_timing=node_timing,
+             db_backend=db_backend,
+             parquet_dir=parquet_dir,
+             prefetch=prefetch)   
 
 
 if __name__=='__main__':